@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import autocomplete, cart_summary, category_tree, conditional, facets, product_cache, ratings, reviews, snapshots, stock  # noqa: F401
+        from .search import install_search_backend_post_migrate
+
+        post_migrate.connect(install_search_backend_post_migrate, sender=self)
@@ -0,0 +1,244 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Products
+from .signals import products_bulk_changed
+
+# Titles scanned for substring matches of queries too short for trigrams.
+SHORT_QUERY_SCAN = 5000
+
+
+def fold(value):
+    return value.casefold()
+
+
+def word_suffixes(folded):
+    """Yield the tail of `folded` starting at every word after the first."""
+    for position in range(1, len(folded)):
+        if folded[position - 1] == " " and folded[position] != " ":
+            yield folded[position:]
+
+
+def trigrams(folded):
+    return {folded[position:position + 3] for position in range(len(folded) - 2)}
+
+
+class ProductTitleIndex:
+    """
+    Per-process autocomplete index over product titles.
+
+    Matches are ranked like the old SQL query: title prefix, then word prefix,
+    then substring, alphabetically within each group and one row per title.
+    Substring matches come from a trigram map; queries shorter than three
+    characters fall back to a bounded scan of the sorted titles.
+    The index is built lazily, kept current by Products signals in this
+    process and rebuilt after AUTOCOMPLETE_INDEX_TTL seconds to pick up
+    writes made by other workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._product_titles = {}
+        self._title_ids = {}
+        self._titles = []
+        self._words = []
+        self._trigrams = {}
+
+    @property
+    def ttl(self):
+        return getattr(settings, "AUTOCOMPLETE_INDEX_TTL", 300)
+
+    def reset(self):
+        with self._lock:
+            self._built_at = None
+            self._product_titles = {}
+            self._title_ids = {}
+            self._titles = []
+            self._words = []
+            self._trigrams = {}
+
+    def is_built(self):
+        return self._built_at is not None
+
+    def build(self):
+        product_titles = dict(Products.objects.values_list("id", "title").iterator())
+        title_ids = {}
+        for product_id, title in product_titles.items():
+            title_ids.setdefault(title, set()).add(product_id)
+
+        titles = []
+        words = []
+        grams = {}
+        for title in title_ids:
+            folded = fold(title)
+            titles.append((folded, title))
+            words.extend((suffix, title) for suffix in word_suffixes(folded))
+            for gram in trigrams(folded):
+                grams.setdefault(gram, set()).add(title)
+        titles.sort()
+        words.sort()
+
+        with self._lock:
+            self._product_titles = product_titles
+            self._title_ids = title_ids
+            self._titles = titles
+            self._words = words
+            self._trigrams = grams
+            self._built_at = time.monotonic()
+
+    def ensure_built(self):
+        built_at = self._built_at
+        if built_at is None or time.monotonic() - built_at > self.ttl:
+            self.build()
+
+    def _add_title(self, title):
+        folded = fold(title)
+        insort(self._titles, (folded, title))
+        for suffix in word_suffixes(folded):
+            insort(self._words, (suffix, title))
+        for gram in trigrams(folded):
+            self._trigrams.setdefault(gram, set()).add(title)
+
+    def _remove_title(self, title):
+        folded = fold(title)
+        self._discard(self._titles, (folded, title))
+        for suffix in word_suffixes(folded):
+            self._discard(self._words, (suffix, title))
+        for gram in trigrams(folded):
+            titles = self._trigrams[gram]
+            titles.discard(title)
+            if not titles:
+                del self._trigrams[gram]
+
+    @staticmethod
+    def _discard(entries, entry):
+        position = bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+
+    def update(self, product_id, title):
+        with self._lock:
+            if not self.is_built():
+                return
+            self._remove_product(product_id)
+            self._product_titles[product_id] = title
+            ids = self._title_ids.setdefault(title, set())
+            if not ids:
+                self._add_title(title)
+            ids.add(product_id)
+
+    def refresh(self, product_ids):
+        if not self.is_built():
+            return
+        rows = Products.objects.filter(id__in=product_ids).values_list("id", "title")
+        titles = dict(rows.iterator())
+        with self._lock:
+            for product_id in product_ids:
+                if product_id in titles:
+                    self.update(product_id, titles[product_id])
+                else:
+                    self.remove(product_id)
+
+    def remove(self, product_id):
+        with self._lock:
+            if self.is_built():
+                self._remove_product(product_id)
+
+    def _remove_product(self, product_id):
+        title = self._product_titles.pop(product_id, None)
+        if title is None:
+            return
+        ids = self._title_ids.get(title)
+        ids.discard(product_id)
+        if not ids:
+            del self._title_ids[title]
+            self._remove_title(title)
+
+    @staticmethod
+    def _prefix_matches(entries, prefix):
+        position = bisect_left(entries, (prefix,))
+        while position < len(entries) and entries[position][0].startswith(prefix):
+            yield entries[position][1]
+            position += 1
+
+    def _substring_matches(self, query):
+        """Titles containing `query`: intersect its trigrams' titles, smallest first, then check."""
+        candidates = None
+        for titles in sorted((self._trigrams.get(gram, ()) for gram in trigrams(query)), key=len):
+            candidates = set(titles) if candidates is None else candidates & titles
+            if not candidates:
+                return []
+        return [title for title in candidates or () if query in fold(title)]
+
+    def search(self, query, limit=10):
+        self.ensure_built()
+        query = fold(query)
+        with self._lock:
+            seen = set()
+            ranked = []
+
+            for title in self._prefix_matches(self._titles, query):
+                seen.add(title)
+                ranked.append(title)
+                if len(ranked) >= limit:
+                    break
+
+            if len(ranked) < limit:
+                word_matches = {
+                    title
+                    for title in self._prefix_matches(self._words, query)
+                    if title not in seen
+                }
+                seen.update(word_matches)
+                ranked.extend(sorted(word_matches, key=lambda title: (fold(title), title)))
+
+            if len(ranked) < limit and len(query) >= 3:
+                substring_matches = [title for title in self._substring_matches(query) if title not in seen]
+                ranked.extend(sorted(substring_matches, key=lambda title: (fold(title), title)))
+            elif len(ranked) < limit:
+                # Too short for trigrams: scan the sorted titles, at most
+                # SHORT_QUERY_SCAN of them, stopping once the page is full.
+                for folded, title in islice(self._titles, SHORT_QUERY_SCAN):
+                    if title not in seen and query in folded:
+                        ranked.append(title)
+                        if len(ranked) >= limit:
+                            break
+
+            return [
+                {"id": min(self._title_ids[title]), "title": title}
+                for title in ranked[:limit]
+            ]
+
+
+product_title_index = ProductTitleIndex()
+
+
+@receiver(post_save, sender=Products)
+def index_product_title(sender, instance=None, update_fields=None, **kwargs):
+    if update_fields is not None and "title" not in update_fields:
+        return
+    transaction.on_commit(
+        lambda: product_title_index.update(instance.id, instance.title)
+    )
+
+
+@receiver(post_delete, sender=Products)
+def unindex_product_title(sender, instance=None, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: product_title_index.remove(product_id))
+
+
+@receiver(products_bulk_changed)
+def reindex_product_titles(sender, product_ids=(), fields=None, **kwargs):
+    if fields is not None and "title" not in fields:
+        return
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: product_title_index.refresh(product_ids))
@@ -0,0 +1,121 @@
+from django.db import transaction
+
+from .cart_summary import evict_cart_summaries
+from .models import Cart, CartItem, Products
+from .stock import available_stock, with_shard_flag
+
+CART_OPERATIONS = ("add", "set", "remove")
+MAX_LINE_QUANTITY = 10
+
+
+class CartBatchError(Exception):
+    pass
+
+
+def parse_operation(raw):
+    if not isinstance(raw, dict) or raw.get("op") not in CART_OPERATIONS:
+        raise CartBatchError(f"op must be one of: {', '.join(CART_OPERATIONS)}.")
+    try:
+        product_id = int(raw.get("id"))
+    except (TypeError, ValueError):
+        raise CartBatchError("Invalid product id.")
+    quantity = None
+    if raw["op"] != "remove":
+        try:
+            quantity = int(raw.get("q"))
+        except (TypeError, ValueError):
+            raise CartBatchError("Invalid quantity.")
+    return raw["op"], product_id, quantity
+
+
+def apply_operation(op, product, line, quantity, available):
+    """Return the line's new quantity (0 removes it) or raise CartBatchError."""
+    if product is None:
+        raise CartBatchError("Product Not Found...")
+    if op == "remove":
+        if line is None:
+            raise CartBatchError("Product Not Found...")
+        return 0
+    if op == "set":
+        if line is None:
+            raise CartBatchError("Product Not Found...")
+        new_quantity = quantity
+    else:
+        new_quantity = (line.quantity if line else 0) + quantity
+    if new_quantity > available:
+        raise CartBatchError("Sorry, we don't have enough stock for this item.")
+    if new_quantity < 1 or new_quantity > MAX_LINE_QUANTITY:
+        raise CartBatchError("You've reached the maximum quantity for this item.")
+    return new_quantity
+
+
+def apply_cart_operations(user, operations, partial=False):
+    """
+    Apply add/set/remove operations to `user`'s cart in one transaction.
+
+    The cart row is locked, then every product and existing line involved is
+    read in one query each; operations run in order against those rows in
+    memory and the result is written with one bulk_create, one bulk_update
+    and one delete. Unless `partial`, any failing operation rolls back the
+    whole batch. Returns (applied, results) with one result per operation.
+    """
+    parsed = []
+    for raw in operations:
+        try:
+            parsed.append(parse_operation(raw))
+        except CartBatchError as err:
+            parsed.append(err)
+    product_ids = {op[1] for op in parsed if not isinstance(op, CartBatchError)}
+
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().get(user=user)
+        products = with_shard_flag(Products.objects.only("id", "stock", "reserved")).in_bulk(product_ids)
+        available = available_stock(products.values())
+        lines = {line.product_id: line for line in CartItem.objects.filter(cart=cart, product_id__in=product_ids)}
+        original = {product_id: line.quantity for product_id, line in lines.items()}
+        dropped = {}
+
+        results = []
+        failed = False
+        for index, op in enumerate(parsed):
+            if isinstance(op, CartBatchError):
+                results.append({"index": index, "status": "error", "error": str(op)})
+                failed = True
+                continue
+            name, product_id, quantity = op
+            line = lines.get(product_id)
+            try:
+                new_quantity = apply_operation(name, products.get(product_id), line, quantity, available.get(product_id))
+            except CartBatchError as err:
+                results.append({"index": index, "op": name, "id": product_id, "status": "error", "error": str(err)})
+                failed = True
+                continue
+            if new_quantity == 0:
+                dropped[product_id] = lines.pop(product_id)
+            elif line is None:
+                # Re-adding a line removed earlier in the batch reuses its row.
+                line = dropped.pop(product_id, None) or CartItem(cart=cart, product_id=product_id)
+                line.quantity = new_quantity
+                lines[product_id] = line
+            else:
+                line.quantity = new_quantity
+            results.append({"index": index, "op": name, "id": product_id, "status": "ok", "quantity": new_quantity})
+
+        if failed and not partial:
+            return False, results
+
+        removed = [product_id for product_id, line in dropped.items() if line.pk is not None]
+        created = [line for line in lines.values() if line.pk is None]
+        updated = [
+            line for line in lines.values()
+            if line.pk is not None and line.quantity != original[line.product_id]
+        ]
+        if created:
+            CartItem.objects.bulk_create(created)
+        if updated:
+            CartItem.objects.bulk_update(updated, ["quantity"])
+        if removed:
+            CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+        # Bulk writes skip the CartItem signals.
+        evict_cart_summaries(cart.id)
+    return True, results
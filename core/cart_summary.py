@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .helper import cache_is_shared
+from .models import Cart, CartItem, Products
+from .pricing import price_cart
+from .signals import products_bulk_changed
+
+# Product columns that feed a cart summary.
+SUMMARY_FIELDS = frozenset(["price", "discount"])
+
+
+def cart_summary_key(cart_id):
+    return f"core:cart-summary:{cart_id}"
+
+
+def cart_id_key(user_id):
+    return f"core:cart-id:{user_id}"
+
+
+def get_cart_id(user_id):
+    """The user's cart id; carts never change owner, so it is cached for good."""
+    key = cart_id_key(user_id)
+    cart_id = cache.get(key)
+    if cart_id is None:
+        cart_id = Cart.objects.filter(user_id=user_id).values_list("id", flat=True).first()
+        if cart_id is not None:
+            cache.set(key, cart_id, None)
+    return cart_id
+
+
+def compute_cart_summary(user_id):
+    """Counts and pricing-engine totals for the cart, from one query."""
+    return price_cart(user_id).as_dict()
+
+
+def get_cart_summary(user_id):
+    """
+    The cart's summary, cached per cart only when the default cache is
+    shared: evictions from a process-local cache would reach one worker and
+    leave the others' summaries stale.
+    """
+    if not cache_is_shared():
+        return compute_cart_summary(user_id)
+    cart_id = get_cart_id(user_id)
+    if cart_id is None:
+        return compute_cart_summary(user_id)
+    key = cart_summary_key(cart_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_cart_summary(user_id)
+        cache.set(key, summary, getattr(settings, "CART_SUMMARY_CACHE_TIMEOUT", 10 * 60))
+    return summary
+
+
+def evict_cart_summaries(*cart_ids):
+    keys = [cart_summary_key(cart_id) for cart_id in cart_ids]
+
+    def evict():
+        cache.delete_many(keys)
+
+    evict()
+    transaction.on_commit(evict)
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def cart_item_changed(sender, instance=None, **kwargs):
+    evict_cart_summaries(instance.cart_id)
+
+
+def evict_carts_holding(product_ids):
+    cart_ids = CartItem.objects.filter(product_id__in=product_ids).values_list("cart_id", flat=True)
+    evict_cart_summaries(*set(cart_ids))
+
+
+@receiver(post_save, sender=Products)
+def product_saved(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not SUMMARY_FIELDS & set(update_fields)):
+        return
+    evict_carts_holding([instance.id])
+
+
+@receiver(products_bulk_changed)
+def products_changed_in_bulk(sender, product_ids=(), fields=None, **kwargs):
+    if fields is None or SUMMARY_FIELDS & set(fields):
+        evict_carts_holding(product_ids)
@@ -0,0 +1,126 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Category, Products
+from .signals import products_bulk_changed
+
+CATEGORY_TREE_CACHE_KEY = "core:category-tree"
+
+
+class CategoryNode:
+    __slots__ = ("id", "name", "parent_id", "children", "parents", "products_count")
+
+    def __init__(self, id, name, parent_id):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.children = []
+        self.parents = []
+        self.products_count = 0
+
+
+class CategoryTree:
+    """
+    Every Category row in an adjacency map with ancestor paths and direct
+    product counts, loaded in two queries and shared through the cache.
+    """
+
+    def __init__(self, rows, counts):
+        self._nodes = {
+            pk: CategoryNode(pk, name, parent_id)
+            for pk, name, parent_id in sorted(rows)
+        }
+        for node in self._nodes.values():
+            node.products_count = counts.get(node.id, 0)
+            parent = self._nodes.get(node.parent_id)
+            if parent is not None:
+                parent.children.append(node.id)
+
+        for node in self._nodes.values():
+            seen = {node.id}
+            parent = self._nodes.get(node.parent_id)
+            while parent is not None and parent.id not in seen:
+                seen.add(parent.id)
+                node.parents.append({"id": parent.id, "name": parent.name})
+                parent = self._nodes.get(parent.parent_id)
+
+        # Changes whenever anything a rendered category shows changes.
+        self.etag = hashlib.sha1(
+            repr(
+                [
+                    (node.id, node.name, node.parent_id, node.products_count)
+                    for node in self._nodes.values()
+                ]
+            ).encode()
+        ).hexdigest()
+
+    @classmethod
+    def load(cls):
+        rows = Category.objects.values_list("id", "name", "parent_id")
+        counts = dict(
+            Products.objects.order_by()
+            .values_list("category_id")
+            .annotate(total=Count("id"))
+        )
+        return cls(rows, counts)
+
+    def __contains__(self, pk):
+        return pk in self._nodes
+
+    def node(self, pk):
+        return self._nodes.get(pk)
+
+    def nodes(self):
+        return list(self._nodes.values())
+
+
+def get_category_tree(required_id=None):
+    tree = cache.get(CATEGORY_TREE_CACHE_KEY)
+    if tree is None or (required_id is not None and required_id not in tree):
+        tree = CategoryTree.load()
+        cache.set(
+            CATEGORY_TREE_CACHE_KEY,
+            tree,
+            getattr(settings, "CATEGORY_TREE_CACHE_TIMEOUT", 60 * 60),
+        )
+    return tree
+
+
+def invalidate_category_tree():
+    cache.delete(CATEGORY_TREE_CACHE_KEY)
+
+
+def schedule_category_tree_invalidation():
+    # Drop it now for this process and again on commit, so a concurrent
+    # request can't re-cache the pre-commit tree.
+    invalidate_category_tree()
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    schedule_category_tree_invalidation()
+
+
+@receiver(post_save, sender=Products)
+def product_saved(sender, created=False, update_fields=None, **kwargs):
+    if created or update_fields is None or "category" in update_fields:
+        schedule_category_tree_invalidation()
+
+
+@receiver(post_delete, sender=Products)
+def product_deleted(sender, **kwargs):
+    schedule_category_tree_invalidation()
+
+
+@receiver(products_bulk_changed)
+def products_changed_in_bulk(sender, fields=None, **kwargs):
+    if fields is None or "category" in fields:
+        schedule_category_tree_invalidation()
@@ -0,0 +1,75 @@
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import Image, Products
+
+
+def make_etag(*parts):
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def timestamp(value):
+    return int(value.timestamp()) if value is not None else None
+
+
+def conditional_get(view_method):
+    """
+    Answer If-None-Match / If-Modified-Since with a 304 before the view runs.
+
+    The view supplies `get_validators(request, *args, **kwargs)` returning
+    `(etag, last_modified)`; either may be None. Both are also set on full
+    responses.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request, *args, **kwargs)
+        etag = quote_etag(etag) if etag else None
+        last_modified = timestamp(last_modified)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            if etag and not response.has_header("ETag"):
+                response.headers["ETag"] = etag
+            if last_modified and not response.has_header("Last-Modified"):
+                response.headers["Last-Modified"] = http_date(last_modified)
+        return response
+
+    return wrapper
+
+
+def queryset_etag(queryset, *parts):
+    """
+    ETag for a filtered product queryset, from one aggregate. Stock, sold
+    and rating totals go in too, since bulk writes can change those columns
+    without moving updated_at. There is no Last-Modified for lists: the
+    newest updated_at doesn't move when a product is deleted or drops out
+    of the filter.
+    """
+    stats = queryset.aggregate(
+        last_modified=Max("updated_at"),
+        total=Count("id"),
+        stock=Sum("stock"),
+        sold=Sum("sold"),
+        rating=Sum("rating"),
+        review_count=Sum("review_count"),
+    )
+    return make_etag(*stats.values(), *parts)
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def touch_product_on_image_change(sender, instance=None, **kwargs):
+    # Images are part of the product payload, so they move its validators.
+    Products.objects.filter(id=instance.product_id).update(updated_at=timezone.now())
@@ -0,0 +1,122 @@
+import csv
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+# (output name, queryset lookup) in column order.
+EXPORT_COLUMNS = (
+    ("id", "id"),
+    ("sku", "sku"),
+    ("title", "title"),
+    ("description", "description"),
+    ("price", "price"),
+    ("discount", "discount"),
+    ("stock", "stock"),
+    ("sold", "sold"),
+    ("rating", "rating"),
+    ("review_count", "review_count"),
+    ("weight", "weight"),
+    ("category_id", "category_id"),
+    ("category", "category__name"),
+    ("created_at", "created_at"),
+    ("updated_at", "updated_at"),
+)
+EXPORT_CHUNK_SIZE = 2000
+# Rows are encoded into one buffer and flushed at about this many characters.
+FLUSH_SIZE = 64 * 1024
+
+
+class _Buffer:
+    """Minimal write target for csv.writer that hands back what it collected."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, value):
+        self.parts.append(value)
+        self.size += len(value)
+
+    def drain(self):
+        value = "".join(self.parts)
+        self.parts = []
+        self.size = 0
+        return value
+
+
+def export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Plain tuples in EXPORT_COLUMNS order, streamed from the database."""
+    lookups = [lookup for _, lookup in EXPORT_COLUMNS]
+    return queryset.values_list(*lookups).iterator(chunk_size=chunk_size)
+
+
+def encode_csv(rows):
+    buffer = _Buffer()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for row in rows:
+        writer.writerow(row)
+        if buffer.size >= FLUSH_SIZE:
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def encode_ndjson(rows):
+    names = [name for name, _ in EXPORT_COLUMNS]
+    encoder = DjangoJSONEncoder(separators=(",", ":"), ensure_ascii=False)
+    buffer = _Buffer()
+    for row in rows:
+        buffer.write(encoder.encode(dict(zip(names, row))))
+        buffer.write("\n")
+        if buffer.size >= FLUSH_SIZE:
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson}
+
+
+def negotiate_encoding(accept_encoding):
+    accepted = {
+        part.split(";")[0].strip().lower()
+        for part in (accept_encoding or "").split(",")
+        if not part.strip().endswith(";q=0")
+    }
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor()
+        flush = compressor.finish
+        process = compressor.process
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        flush = compressor.flush
+        process = compressor.compress
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield flush()
+
+
+def stream_export(queryset, format, encoding=None):
+    """Encoded (and optionally compressed) byte chunks of the export."""
+    chunks = (text.encode() for text in ENCODERS[format](export_rows(queryset)) if text)
+    if encoding:
+        chunks = compress(chunks, encoding)
+    return chunks
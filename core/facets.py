@@ -0,0 +1,148 @@
+import hashlib
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Max, Min, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .category_tree import get_category_tree
+from .models import Category, Products
+from .signals import products_bulk_changed
+
+FACETS_VERSION_KEY = "core:facets:version"
+FACET_FILTER_PARAMS = ("title", "category", "min_price", "max_price", "search")
+# Saves that only touch these columns can't move any facet count.
+FACET_NEUTRAL_FIELDS = frozenset(["stock", "sold", "updated_at"])
+
+
+def price_bucket_bounds():
+    return list(getattr(settings, "PRODUCT_FACET_PRICE_BUCKETS", [25, 50, 100, 250, 500]))
+
+
+def rating_bucket_floors():
+    return [5, 4, 3, 2, 1]
+
+
+def facets_version():
+    version = cache.get(FACETS_VERSION_KEY)
+    if version is None:
+        version = 1
+        cache.add(FACETS_VERSION_KEY, version, None)
+    return version
+
+
+def bump_facets_version():
+    # Bumped now and again on commit: facets another request computes from
+    # pre-commit rows in between are cached under a version that is retired.
+    def bump():
+        try:
+            cache.incr(FACETS_VERSION_KEY)
+        except ValueError:
+            cache.set(FACETS_VERSION_KEY, 2, None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def facets_cache_key(query_params):
+    normalized = {
+        name: sorted(query_params.getlist(name))
+        for name in FACET_FILTER_PARAMS
+        if query_params.getlist(name)
+    }
+    digest = hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    return f"core:facets:{facets_version()}:{digest}"
+
+
+def compute_facets(queryset):
+    """
+    Category counts, price buckets and rating buckets for `queryset` from a
+    single GROUP BY over (category, price bucket, rating bucket).
+    """
+    bounds = price_bucket_bounds()
+    floors = rating_bucket_floors()
+    price_bucket = Case(
+        *[When(price__lt=bound, then=Value(index)) for index, bound in enumerate(bounds)],
+        default=Value(len(bounds)),
+        output_field=IntegerField(),
+    )
+    rating_bucket = Case(
+        *[When(rating__gte=floor, then=Value(floor)) for floor in floors],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    rows = (
+        queryset.order_by()
+        .values("category_id", price_bucket=price_bucket, rating_bucket=rating_bucket)
+        .annotate(count=Count("id"), min_price=Min("price"), max_price=Max("price"))
+    )
+
+    total = 0
+    low = high = None
+    categories = {}
+    prices = [0] * (len(bounds) + 1)
+    ratings = dict.fromkeys(floors + [0], 0)
+    for row in rows:
+        count = row["count"]
+        total += count
+        categories[row["category_id"]] = categories.get(row["category_id"], 0) + count
+        prices[row["price_bucket"]] += count
+        ratings[row["rating_bucket"]] += count
+        low = row["min_price"] if low is None else min(low, row["min_price"])
+        high = row["max_price"] if high is None else max(high, row["max_price"])
+
+    tree = get_category_tree()
+    edges = [Decimal(0)] + [Decimal(str(bound)) for bound in bounds] + [None]
+    return {
+        "count": total,
+        "price_range": {"min": low, "max": high},
+        "categories": [
+            {
+                "id": category_id,
+                "name": tree.node(category_id).name if category_id in tree else None,
+                "count": count,
+            }
+            for category_id, count in sorted(categories.items(), key=lambda item: (-item[1], item[0]))
+        ],
+        "price_buckets": [
+            {"min": edges[index], "max": edges[index + 1], "count": count}
+            for index, count in enumerate(prices)
+        ],
+        "rating_buckets": [
+            {"min_rating": floor, "count": ratings[floor]} for floor in floors + [0]
+        ],
+    }
+
+
+def get_facets(queryset, query_params):
+    key = facets_cache_key(query_params)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, getattr(settings, "PRODUCT_FACETS_CACHE_TIMEOUT", 5 * 60))
+    return facets
+
+
+@receiver(post_save, sender=Products)
+def product_saved(sender, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= FACET_NEUTRAL_FIELDS:
+        return
+    bump_facets_version()
+
+
+@receiver(products_bulk_changed)
+def products_changed_in_bulk(sender, fields=None, **kwargs):
+    if fields is not None and set(fields) <= FACET_NEUTRAL_FIELDS:
+        return
+    bump_facets_version()
+
+
+@receiver(post_delete, sender=Products)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, **kwargs):
+    bump_facets_version()
@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 from django.conf import settings
 import random
 import sib_api_v3_sdk
@@ -32,3 +34,25 @@ def send_otp(recipient_email,recipient_name,otp,template_id=3):
 
 def genereat_otp(digit=6):
     return random.randint(10**(digit-1), 10**digit-1)
+
+
+MONEY_QUANT = Decimal("0.01")
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Cache backends private to one process: other workers can't read what one
+# worker stores or see what it evicts.
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def cache_is_shared(alias="default"):
+    return settings.CACHES[alias]["BACKEND"] not in PROCESS_LOCAL_CACHES
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+POLL_INTERVAL = 0.1
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, "lists"):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def lease():
+    return timezone.now() + timedelta(seconds=getattr(settings, "IDEMPOTENCY_LEASE", 120))
+
+
+def claim_key(user, key, fingerprint):
+    """Create the in-progress row for `key`, or return the one already there (and False)."""
+    ttl = timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 24 * 60 * 60))
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint=fingerprint, locked_until=lease(), expires_at=timezone.now() + ttl
+            )
+        return record, True
+    except IntegrityError:
+        return IdempotencyKey.objects.filter(user=user, key=key).first(), False
+
+
+def take_over(record):
+    """Claim an in-progress key whose lease lapsed; True if this request now owns it."""
+    locked_until = lease()
+    lapsed = Q(locked_until__isnull=True) | Q(locked_until__lte=timezone.now())
+    taken = IdempotencyKey.objects.filter(lapsed, pk=record.pk, status=IdempotencyKey.IN_PROGRESS).update(
+        locked_until=locked_until
+    )
+    record.locked_until = locked_until
+    return bool(taken)
+
+
+def wait_for_completion(record):
+    """
+    Poll an in-progress key until it completes, is abandoned, its lease
+    lapses or IDEMPOTENCY_WAIT_TIMEOUT passes.
+    """
+    deadline = time.monotonic() + getattr(settings, "IDEMPOTENCY_WAIT_TIMEOUT", 10)
+    while (
+        record is not None
+        and record.status == IdempotencyKey.IN_PROGRESS
+        and record.locked_until is not None
+        and record.locked_until > timezone.now()
+        and time.monotonic() < deadline
+    ):
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+def replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+def idempotent(view_method):
+    """
+    Make a mutating view method safe to retry with an Idempotency-Key header.
+
+    The first request with a key runs the view and stores its response for
+    IDEMPOTENCY_KEY_TTL; retries with the same key and payload get that
+    response back without the view running again. A duplicate arriving
+    while the first is still running waits up to IDEMPOTENCY_WAIT_TIMEOUT
+    for its result, then gets a 409; once the first request's
+    IDEMPOTENCY_LEASE lapses without a result (its worker died), a retry
+    takes the key over and runs the view. Reusing a key for a different payload
+    is a 422. Server errors are not stored, so they can be retried; views
+    must report upstream failures (e.g. Stripe) as a 502/503, not a 4xx, or
+    the failure is replayed for the key's lifetime.
+    Requests without the header are unaffected.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return Response({"error": f"{HEADER} is too long."}, status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = request_fingerprint(request)
+        record, created = claim_key(request.user, key, fingerprint)
+        if not created and (record is None or record.expires_at <= timezone.now()):
+            IdempotencyKey.objects.filter(user=request.user, key=key, expires_at__lte=timezone.now()).delete()
+            record, created = claim_key(request.user, key, fingerprint)
+
+        if not created:
+            if record is not None and record.fingerprint != fingerprint:
+                return Response(
+                    {"error": f"{HEADER} was already used for a different request."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            record = wait_for_completion(record)
+            if record is not None and record.status == IdempotencyKey.COMPLETED:
+                return replay(record)
+            if record is None:
+                record, created = claim_key(request.user, key, fingerprint)
+            else:
+                created = take_over(record)
+
+        if not created:
+            return Response(
+                {"error": "A request with this Idempotency-Key is still in progress."},
+                status=status.HTTP_409_CONFLICT,
+                headers={"Retry-After": "1"},
+            )
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+            return response
+
+        record.status = IdempotencyKey.COMPLETED
+        record.response_status = response.status_code
+        # Stored as rendered, so replays match the original response.
+        record.response_body = json.loads(JSONRenderer().render(response.data) or "null")
+        record.save(update_fields=["status", "response_status", "response_body"])
+        return response
+
+    return wrapper
+
+
+def purge_idempotency_keys(now=None):
+    """Delete expired keys; returns how many were removed."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
@@ -0,0 +1,146 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudinary import uploader
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .helper import cache_is_shared
+from .models import Image, Products
+from .serializers import ImageVariantSerializer
+from .signals import products_bulk_changed
+
+UPLOAD_JOB_TIMEOUT = 24 * 60 * 60
+
+
+class CloudinaryUploadClient:
+    """Default IMAGE_UPLOAD_CLIENT: one Cloudinary upload call per file."""
+
+    def upload(self, file, **options):
+        return uploader.upload_resource(file, **options)
+
+
+def get_upload_client():
+    path = getattr(settings, "IMAGE_UPLOAD_CLIENT", "core.image_uploads.CloudinaryUploadClient")
+    return import_string(path)()
+
+
+def upload_options(image):
+    """The upload options CloudinaryField.pre_save would use for `image`."""
+    field = Image._meta.get_field("image")
+    options = {"type": field.type, "resource_type": field.resource_type}
+    options.update({key: value(image) if callable(value) else value for key, value in field.options.items()})
+    return options
+
+
+def upload_images(product, files):
+    """
+    Upload `files` concurrently on a bounded pool, then insert every image
+    that made it in one bulk_create. Returns (images, errors).
+    """
+    client = get_upload_client()
+    images = [Image(product=product) for _ in files]
+    workers = max(1, min(len(files), getattr(settings, "IMAGE_UPLOAD_WORKERS", 4)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-upload") as pool:
+        futures = [
+            pool.submit(client.upload, file, **upload_options(image))
+            for file, image in zip(files, images)
+        ]
+
+    uploaded = []
+    errors = []
+    for file, image, future in zip(files, images, futures):
+        try:
+            image.image = future.result()
+        except Exception as err:
+            errors.append({"file": file.name, "error": str(err)})
+            continue
+        image.urls = image.build_variant_urls()
+        uploaded.append(image)
+
+    if uploaded:
+        # bulk_create skips Image signals: touch the product and tell the
+        # caches ourselves.
+        with transaction.atomic():
+            Image.objects.bulk_create(uploaded)
+            Products.objects.filter(id=product.id).update(updated_at=timezone.now())
+            products_bulk_changed.send(sender=Products, product_ids=[product.id], fields=["updated_at"])
+    return uploaded, errors
+
+
+def async_uploads_available():
+    """Background jobs keep their state in the default cache, so it must be shared."""
+    return cache_is_shared()
+
+
+def upload_job_key(job_id):
+    return f"core:image-upload-job:{job_id}"
+
+
+def get_upload_job(job_id):
+    return cache.get(upload_job_key(job_id))
+
+
+def set_upload_job(job_id, **state):
+    cache.set(upload_job_key(job_id), {"id": job_id, **state}, UPLOAD_JOB_TIMEOUT)
+
+
+_job_executor = None
+
+
+def job_executor():
+    global _job_executor
+    if _job_executor is None:
+        _job_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, "IMAGE_UPLOAD_JOB_WORKERS", 2),
+            thread_name_prefix="image-upload-job",
+        )
+    return _job_executor
+
+
+def submit_job(function, *args):
+    def run():
+        try:
+            function(*args)
+        finally:
+            # Worker threads hold their own connection; don't leak it.
+            connection.close()
+
+    return job_executor().submit(run)
+
+
+def run_upload_job(job_id, product_id, files):
+    set_upload_job(job_id, status="running", product=product_id)
+    try:
+        product = Products.objects.get(id=product_id)
+        images, errors = upload_images(product, files)
+    except Exception as err:
+        set_upload_job(job_id, status="failed", product=product_id, images=[], errors=[{"error": str(err)}])
+        raise
+    set_upload_job(
+        job_id,
+        status="done",
+        product=product_id,
+        images=ImageVariantSerializer(images, many=True).data,
+        errors=errors,
+    )
+
+
+def start_upload_job(product, files):
+    """
+    Queue `files` for upload in the background and return the job id.
+    The request's uploads are read into memory first, since Django removes
+    its temporary files once the response is sent.
+    """
+    job_id = uuid.uuid4().hex
+    files = [
+        SimpleUploadedFile(file.name, file.read(), content_type=file.content_type)
+        for file in files
+    ]
+    set_upload_job(job_id, status="pending", product=product.id)
+    transaction.on_commit(lambda: submit_job(run_upload_job, job_id, product.id, files))
+    return job_id
@@ -0,0 +1,181 @@
+import csv
+import io
+import json
+
+from django.db import DatabaseError, transaction
+from rest_framework import serializers
+
+from .models import Category, Products
+from .signals import products_bulk_changed
+from .stock import adjust_shard_stock
+
+
+class ProductImportRowSerializer(serializers.Serializer):
+    sku = serializers.CharField(max_length=100)
+    title = serializers.CharField(max_length=250)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0)
+    stock = serializers.IntegerField(required=False, min_value=0)
+    category = serializers.CharField(max_length=55)
+    discount = serializers.FloatField(required=False, min_value=0, max_value=100)
+    weight = serializers.FloatField(required=False, min_value=0)
+
+
+IMPORT_FORMATS = ("csv", "ndjson")
+# Columns an existing sku may be updated on; only those a row supplies are
+# written, so a price-only feed leaves stock, discount etc. alone.
+UPSERT_FIELDS = ["title", "description", "price", "stock", "category", "discount", "weight"]
+
+
+def detect_format(name, default="csv"):
+    name = (name or "").lower()
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if name.endswith(".csv"):
+        return "csv"
+    return default
+
+
+def iter_rows(stream, format):
+    """Yield (row_number, dict-or-error) pairs from a binary or text stream."""
+    if hasattr(stream, "chunks"):
+        # Django UploadedFile: read the underlying file object directly.
+        stream = stream.file
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+    if format == "csv":
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            # Empty CSV cells mean "not given": new rows get model defaults
+            # and existing rows keep their value.
+            yield number, {key: value for key, value in row.items() if key and value != ""}
+    elif format == "ndjson":
+        number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as err:
+                yield number, ValueError(f"Invalid JSON: {err.msg}")
+                continue
+            if not isinstance(row, dict):
+                yield number, ValueError("Each line must be a JSON object.")
+                continue
+            yield number, row
+    else:
+        raise ValueError(f"Unsupported import format: {format}")
+
+
+class ProductImporter:
+    """
+    Streams rows, validates them and upserts by `sku` in chunked
+    bulk_create(update_conflicts=True) calls, one transaction per chunk and
+    one upsert per set of supplied columns within it. Categories are
+    resolved by name from a dict loaded once per import.
+    """
+
+    def __init__(self, chunk_size=1000, max_errors=1000):
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+        self._categories = None
+
+    @property
+    def categories(self):
+        if self._categories is None:
+            self._categories = {}
+            for pk, name in Category.objects.order_by("-id").values_list("id", "name"):
+                self._categories[name] = pk
+        return self._categories
+
+    def add_error(self, row, errors):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"row": row, "errors": errors})
+
+    def run(self, stream, format):
+        chunk = []
+        for number, row in iter_rows(stream, format):
+            if isinstance(row, Exception):
+                self.add_error(number, {"non_field_errors": [str(row)]})
+                continue
+            validated = self.validate(number, row)
+            if validated is not None:
+                chunk.append((number, *validated))
+            if len(chunk) >= self.chunk_size:
+                self.write(chunk)
+                chunk = []
+        if chunk:
+            self.write(chunk)
+        return self.report()
+
+    def validate(self, number, row):
+        serializer = ProductImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            self.add_error(number, serializer.errors)
+            return None
+        data = serializer.validated_data
+        category_id = self.categories.get(data.pop("category"))
+        if category_id is None:
+            self.add_error(number, {"category": ["Unknown category."]})
+            return None
+        supplied = frozenset(["category", *data])
+        return Products(category_id=category_id, **data), supplied
+
+    def write(self, chunk):
+        # Last occurrence of a sku within a chunk wins; one upsert can't touch a row twice.
+        by_sku = {product.sku: (number, product, supplied) for number, product, supplied in chunk}
+        self.drop_stock_below_holds(by_sku)
+        skus = list(by_sku)
+        if not skus:
+            return
+        groups = {}
+        for _, product, supplied in by_sku.values():
+            groups.setdefault(supplied, []).append(product)
+        try:
+            with transaction.atomic():
+                existing = set(Products.objects.filter(sku__in=skus).values_list("sku", flat=True))
+                restocked = [sku for sku in skus if "stock" in by_sku[sku][2]]
+                sharded = Products.objects.filter(sku__in=restocked, stock_shards__isnull=False).distinct()
+                synced = {sku: (product_id, stock) for sku, product_id, stock in sharded.values_list("sku", "id", "stock")}
+                for supplied, products in groups.items():
+                    Products.objects.bulk_create(
+                        products,
+                        update_conflicts=True,
+                        unique_fields=["sku"],
+                        update_fields=[field for field in UPSERT_FIELDS if field in supplied] + ["updated_at"],
+                    )
+                # Sharded products sell from their shards, which the next sync
+                # copies over Products.stock: apply the new stock there too.
+                for sku, (product_id, stock) in synced.items():
+                    adjust_shard_stock(product_id, by_sku[sku][1].stock - stock)
+                product_ids = list(Products.objects.filter(sku__in=skus).values_list("id", flat=True))
+                products_bulk_changed.send(sender=Products, product_ids=product_ids)
+        except DatabaseError as err:
+            for number, _, _ in by_sku.values():
+                self.add_error(number, {"non_field_errors": [str(err)]})
+            return
+        self.updated += len(existing)
+        self.created += len(skus) - len(existing)
+
+    def drop_stock_below_holds(self, by_sku):
+        """Reject rows that would set stock below the units open checkouts hold."""
+        held = dict(Products.objects.filter(sku__in=list(by_sku), reserved__gt=0).values_list("sku", "reserved"))
+        for sku, reserved in held.items():
+            number, product, supplied = by_sku[sku]
+            if "stock" in supplied and product.stock < reserved:
+                self.add_error(number, {"stock": [f"{reserved} units are held by open checkouts; stock can't go below that."]})
+                del by_sku[sku]
+
+    def report(self):
+        return {
+            "created": self.created,
+            "updated": self.updated,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
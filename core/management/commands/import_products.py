@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importers import IMPORT_FORMATS, ProductImporter, detect_format
+
+
+class Command(BaseCommand):
+    help = "Upsert products by sku from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=IMPORT_FORMATS)
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--max-errors", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        format = options["format"] or detect_format(options["path"])
+        importer = ProductImporter(chunk_size=options["chunk_size"], max_errors=options["max_errors"])
+        try:
+            with open(options["path"], "rb") as stream:
+                report = importer.run(stream, format)
+        except OSError as err:
+            raise CommandError(str(err))
+
+        for error in report["errors"]:
+            self.stderr.write(f"Row {error['row']}: {json.dumps(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report['created']}, updated {report['updated']}, {report['error_count']} rows rejected."
+        ))
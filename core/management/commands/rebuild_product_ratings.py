@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.ratings import rebuild_product_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute review aggregates and Products.rating/review_count from "
+        "Reviews in one grouped pass. Products without reviews are reset to 0."
+    )
+
+    def handle(self, *args, **options):
+        changed = rebuild_product_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt product ratings; {len(changed)} products changed."))
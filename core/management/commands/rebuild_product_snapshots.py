@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Products, ProductSnapshot
+from core.snapshots import refresh_product_snapshots
+
+
+class Command(BaseCommand):
+    help = "Rebuild denormalized product snapshots (missing or outdated ones by default)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Rebuild every snapshot.")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        products = Products.objects.order_by("id")
+        if not options["all"]:
+            current = ProductSnapshot.objects.filter(version=ProductSnapshot.VERSION)
+            products = products.exclude(id__in=current.values("product_id"))
+        product_ids = list(products.values_list("id", flat=True))
+        refresh_product_snapshots(product_ids, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(product_ids)} product snapshots."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.stock import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        "Release stock held by abandoned checkout sessions whose reservations "
+        "have expired. Run it periodically (e.g. from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Reservations released per transaction.")
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired reservations."))
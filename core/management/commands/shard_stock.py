@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Products
+from core.stock import StockShardError, shard_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Split hot products' stock across N counter rows so concurrent "
+        "checkouts stop queuing on one row lock. --shards 0 merges them back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("product_ids", nargs="+", type=int)
+        parser.add_argument("--shards", type=int, default=8)
+
+    def handle(self, *args, **options):
+        if options["shards"] < 0:
+            raise CommandError("--shards must be 0 or more.")
+        for product_id in options["product_ids"]:
+            try:
+                product = shard_stock(product_id, options["shards"])
+            except Products.DoesNotExist:
+                raise CommandError(f"Product {product_id} does not exist.")
+            except StockShardError as err:
+                raise CommandError(str(err))
+            if options["shards"]:
+                message = f"{product.title}: {product.stock} units across {options['shards']} shards."
+            else:
+                message = f"{product.title}: shards merged back, {product.stock} units."
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.stock import sync_sharded_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy sharded products' shard totals into Products.stock/sold. Run it "
+        "periodically (e.g. from cron) so listings and caches stay current."
+    )
+
+    def handle(self, *args, **options):
+        changed = sync_sharded_stock()
+        self.stdout.write(self.style.SUCCESS(f"Synced stock for {len(changed)} sharded products."))
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    from core.search import install_search_backend
+
+    install_search_backend(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from core.search import uninstall_search_backend
+
+    uninstall_search_backend(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0015_money_constraints_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
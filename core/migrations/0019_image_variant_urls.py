@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_variant_urls(apps, schema_editor):
+    Image = apps.get_model("core", "Image")
+    images = list(Image.objects.exclude(image=""))
+    try:
+        for image in images:
+            image.urls = {
+                name: image.image.build_url(**options)
+                for name, options in settings.IMAGE_VARIANTS.items()
+            }
+    except ValueError:
+        # Cloudinary isn't configured here; rows are filled on their next save.
+        return
+    Image.objects.bulk_update(images, ["urls"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0018_product_snapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="image",
+            name="urls",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="productsnapshot",
+            name="version",
+            field=models.PositiveSmallIntegerField(),
+        ),
+        migrations.RunPython(backfill_variant_urls, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def rename_duplicate_skus(apps, schema_editor):
+    Products = apps.get_model("core", "Products")
+    from django.db.models import Count, Min
+
+    for row in (
+        Products.objects.values("sku")
+        .annotate(row_count=Count("id"), keep_id=Min("id"))
+        .filter(row_count__gt=1)
+    ):
+        for product in Products.objects.filter(sku=row["sku"]).exclude(id=row["keep_id"]):
+            product.sku = f"{product.sku}-{product.id}"[-100:]
+            product.save(update_fields=["sku"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0019_image_variant_urls"),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_skus, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="products",
+            constraint=models.UniqueConstraint(fields=("sku",), name="unique_product_sku"),
+        ),
+    ]
@@ -0,0 +1,50 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_product_ratings(apps, schema_editor):
+    # Only products with reviews are touched; the rest keep their seeded
+    # rating/review_count until `rebuild_product_ratings` is run.
+    Products = apps.get_model("core", "Products")
+    ProductRating = apps.get_model("core", "ProductRating")
+    Reviews = apps.get_model("core", "Reviews")
+    star_counts = {f"stars_{stars}": Count("id", filter=Q(rating=stars)) for stars in range(1, 6)}
+    rows = Reviews.objects.order_by().values("product_id").annotate(
+        rating_sum=Sum("rating"), rating_count=Count("id"), **star_counts
+    )
+    stats = [ProductRating(**row) for row in rows]
+    ProductRating.objects.bulk_create(stats, batch_size=500)
+    products = [
+        Products(id=stat.product_id, rating=stat.rating_sum / stat.rating_count, review_count=stat.rating_count)
+        for stat in stats
+    ]
+    Products.objects.bulk_update(products, ["rating", "review_count"], batch_size=500)
+    # Their snapshots now carry old ratings; listings serialize them live
+    # until `rebuild_product_snapshots` runs.
+    ProductSnapshot = apps.get_model("core", "ProductSnapshot")
+    ProductSnapshot.objects.filter(product_id__in=[stat.product_id for stat in stats]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_unique_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to='core.products')),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('stars_1', models.PositiveIntegerField(default=0)),
+                ('stars_2', models.PositiveIntegerField(default=0)),
+                ('stars_3', models.PositiveIntegerField(default=0)),
+                ('stars_4', models.PositiveIntegerField(default=0)),
+                ('stars_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_product_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_order_item_snapshots(apps, schema_editor):
+    # Purchase-time prices were never stored. Orders were charged the
+    # undiscounted product.price back then, so existing lines get that plus
+    # the product's current title and first image.
+    Order_Item = apps.get_model("core", "Order_Item")
+    Image = apps.get_model("core", "Image")
+    images = {}
+    for product_id, urls in Image.objects.order_by("-id").values_list("product_id", "urls"):
+        images[product_id] = urls.get("thumbnail") or urls.get("full") or ""
+    batch = []
+    for item in Order_Item.objects.select_related("product").iterator(chunk_size=500):
+        product = item.product
+        item.unit_price = product.price
+        item.title = product.title
+        item.image = images.get(product.id, "")
+        batch.append(item)
+        if len(batch) == 500:
+            Order_Item.objects.bulk_update(batch, ["unit_price", "title", "image"])
+            batch = []
+    Order_Item.objects.bulk_update(batch, ["unit_price", "title", "image"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_stock_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order_item',
+            name='image',
+            field=models.URLField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='order_item',
+            name='title',
+            field=models.CharField(blank=True, default='', max_length=250),
+        ),
+        migrations.AddField(
+            model_name='order_item',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='order_item',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='core.order'),
+        ),
+        migrations.RunPython(backfill_order_item_snapshots, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.base_user import BaseUserManager
 from django.db.models.signals import post_save
@@ -6,7 +8,10 @@ from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 from django.conf import settings
 from phonenumber_field.modelfields import PhoneNumberField
+from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
+from django.core.serializers.json import DjangoJSONEncoder
+from cloudinary import CloudinaryResource
 from cloudinary.models import CloudinaryField
 # Create your models here.
 
@@ -75,6 +80,8 @@ class Products(models.Model):
     review_count = models.IntegerField(default=0)
     stock = models.IntegerField(default=0)
     sold = models.IntegerField(default=0)
+    # Units held by unexpired StockReservation rows; see core/stock.py.
+    reserved = models.IntegerField(default=0, editable=False)
     category = models.ForeignKey('category',related_name="products",on_delete=models.CASCADE)
     discount = models.FloatField(default=0)
     sku = models.CharField(max_length=100)
@@ -84,6 +91,14 @@ class Products(models.Model):
     def __str__(self) -> str:
         return self.title
 
+    @property
+    def available(self):
+        return self.stock - self.reserved
+
+    def clean(self):
+        if self.stock < self.reserved:
+            raise ValidationError({"stock": f"{self.reserved} units are held by open checkouts; stock can't go below that."})
+
     class Meta:
         indexes = [
             models.Index(fields=["title"], name="product_title_idx"),
@@ -91,14 +106,113 @@ class Products(models.Model):
             models.Index(fields=["created_at"], name="product_created_idx"),
             models.Index(fields=["rating"], name="product_rating_idx"),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=["sku"], name="unique_product_sku"),
+        ]
     
 
+class ProductSnapshot(models.Model):
+    """
+    Pre-rendered ProductSerializer payload (category stored as its id) that
+    list endpoints emit directly. Bump VERSION whenever that payload changes
+    shape; stale rows are ignored until rebuilt.
+    """
+    VERSION = 2
+
+    product = models.OneToOneField(Products, on_delete=models.CASCADE, primary_key=True, related_name='snapshot')
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    version = models.PositiveSmallIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class ProductRating(models.Model):
+    """
+    Running review aggregates per product, kept current with F() updates on
+    every review write. Products.rating/review_count are derived from it.
+    `rating_count` includes 0-star reviews, which have no histogram bucket.
+    """
+    product = models.OneToOneField(Products, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats')
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    stars_1 = models.PositiveIntegerField(default=0)
+    stars_2 = models.PositiveIntegerField(default=0)
+    stars_3 = models.PositiveIntegerField(default=0)
+    stars_4 = models.PositiveIntegerField(default=0)
+    stars_5 = models.PositiveIntegerField(default=0)
+
+    @property
+    def histogram(self):
+        return {stars: getattr(self, f'stars_{stars}') for stars in range(1, 6)}
+
+
+class StockReservation(models.Model):
+    """
+    Units held for a Stripe checkout session until it is paid, expires or is
+    swept. Products.reserved is the running sum of a product's holds.
+    """
+    session_id = models.CharField(max_length=255)
+    # The customer whose checkout holds it, so a new checkout can replace it.
+    user = models.ForeignKey('CustomUser', null=True, blank=True, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Products, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["session_id"], name="reservation_session_idx"),
+            models.Index(fields=["expires_at"], name="reservation_expires_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["session_id", "product"], name="unique_session_product_reservation"),
+        ]
+
+
+class StockShard(models.Model):
+    """
+    One of N counters a hot product's stock is split across (opt in with
+    `manage.py shard_stock`). While a product has shards they hold its
+    sellable units; Products.stock/sold are synced totals.
+    """
+    product = models.ForeignKey(Products, on_delete=models.CASCADE, related_name='stock_shards')
+    index = models.PositiveSmallIntegerField()
+    stock = models.IntegerField(default=0)
+    # Units sold from this shard since the last sync folded them into Products.sold.
+    sold = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["product", "index"], name="unique_product_stock_shard"),
+        ]
+
+
 class Image(models.Model):
     product = models.ForeignKey(Products,on_delete=models.CASCADE,related_name='imgs')
     image = CloudinaryField(folder='imgs/')
+    # Delivery URL per settings.IMAGE_VARIANTS name, built once on save.
+    urls = models.JSONField(default=dict, blank=True, editable=False)
     
     def __str__(self) -> str:
-        return self.image.url
+        return self.urls.get('full') or self.image.url
+
+    def build_variant_urls(self):
+        resource = self._meta.get_field('image').to_python(self.image)
+        if not isinstance(resource, CloudinaryResource) or not resource.public_id:
+            return {}
+        return {
+            name: resource.build_url(**options)
+            for name, options in settings.IMAGE_VARIANTS.items()
+        }
+
+    def save(self, *args, **kwargs):
+        # Upload first (a no-op for stored resources) so the variant URLs are
+        # in place before post_save listeners render this image.
+        self._meta.get_field('image').pre_save(self, self._state.adding)
+        self.urls = self.build_variant_urls()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'urls'}
+        super().save(*args, **kwargs)
 
 class WishList(models.Model):
     user = models.ForeignKey(CustomUser,on_delete=models.CASCADE)
@@ -138,13 +252,61 @@ class CartItem(models.Model):
         ]
 
 
+class CategoryQuerySet(models.QuerySet):
+    def with_descendants(self):
+        """These categories plus everything below them, as one path-prefix filter."""
+        paths = list(self.values_list('path', flat=True))
+        if not paths:
+            return self.none()
+        matches = models.Q()
+        for path in paths:
+            matches |= models.Q(path__startswith=path)
+        return self.model.objects.filter(matches)
+
+
 class Category(models.Model):
     name = models.CharField(max_length=55,null=False)
     parent = models.ForeignKey('self',related_name = "children",null=True,blank=True,on_delete=models.CASCADE)
+    # Materialized path of ids from the root, e.g. "/1/4/9/".
+    path = models.CharField(max_length=255, db_index=True, default="", editable=False)
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self) -> str:
         return self.name
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # Paths are read from the database: a cached parent (or this
+            # instance) may predate a move that rewrote them.
+            paths = dict(Category.objects.filter(pk__in=[self.pk, self.parent_id]).values_list('pk', 'path'))
+            parent_path = paths.get(self.parent_id, "/") if self.parent_id else "/"
+            if self.pk and f"/{self.pk}/" in parent_path:
+                raise ValueError("A category cannot be moved under its own subtree.")
+
+            old_path = paths.get(self.pk, "") if self.pk else ""
+            super().save(*args, **kwargs)
+            new_path = f"{parent_path}{self.pk}/"
+            if new_path != old_path:
+                Category.objects.filter(pk=self.pk).update(path=new_path)
+                if old_path:
+                    Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(new_path), Substr('path', len(old_path) + 1))
+                    )
+                self.path = new_path
+
+    def ancestor_ids(self):
+        return [int(pk) for pk in self.path.strip("/").split("/")[:-1] if pk]
+
+    def get_ancestors(self):
+        return Category.objects.filter(id__in=self.ancestor_ids())
+
+    def get_descendants(self, include_self=False):
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
 class Reviews(models.Model):
     product = models.ForeignKey(Products,on_delete=models.CASCADE)
     user = models.ForeignKey(CustomUser,on_delete=models.CASCADE)
@@ -155,6 +317,11 @@ class Reviews(models.Model):
     def __str__(self) -> str:
         return f"{self.body[:30]}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["product", "created_at", "id"], name="review_product_created_idx"),
+        ]
+
 
 
 class Order(models.Model):
@@ -180,8 +347,42 @@ class Order(models.Model):
 
 class Order_Item(models.Model):
     product = models.ForeignKey(Products,on_delete=models.CASCADE)
-    order = models.ForeignKey(Order,on_delete=models.CASCADE)
+    order = models.ForeignKey(Order,on_delete=models.CASCADE,related_name='order_items')
     quantity = models.PositiveIntegerField(default=1)
+    # What the line looked like at purchase time, so order history never
+    # re-joins live products or shows today's price.
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    title = models.CharField(max_length=250, blank=True, default='')
+    image = models.URLField(max_length=500, blank=True, default='')
+
+class IdempotencyKey(models.Model):
+    """
+    A client's Idempotency-Key for one mutating request: the request's
+    fingerprint while it runs, then the response that retries replay.
+    """
+    IN_PROGRESS = 'in_progress'
+    COMPLETED = 'completed'
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=[(IN_PROGRESS, 'In progress'), (COMPLETED, 'Completed')], default=IN_PROGRESS)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # While in progress, the lease of the request running it; a retry may
+    # take over once it lapses (e.g. the worker was killed mid-request).
+    locked_until = models.DateTimeField(null=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["expires_at"], name="idempotency_expires_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="unique_user_idempotency_key"),
+        ]
+
 
 class OTP(models.Model):    
     email = models.EmailField(null=False)
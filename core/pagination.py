@@ -0,0 +1,159 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .helper import parse_int
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over one ordering column plus `id` as a tie-breaker.
+
+    Pages are fetched with `WHERE col >= value AND (col > value OR id > pk)
+    ORDER BY col, id LIMIT n`: the leading `col >= value` lets an index on
+    `col` start a range scan at the cursor, and there is no COUNT and no
+    OFFSET, so every page costs the same regardless of depth.
+
+    The ordering column comes from the view's `?ordering=` (first term
+    only). Without one, a queryset annotated with `rank_annotation` (see
+    ProductSearchFilter) is paged by relevance, anything else by
+    `default_ordering`.
+    """
+
+    page_size = 5
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    default_ordering = '-created_at'
+    rank_annotation = 'search_rank'
+    tie_breaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    @classmethod
+    def requested(cls, request):
+        params = request.query_params
+        return cls.cursor_query_param in params or params.get(cls.mode_query_param) == 'cursor'
+
+    def get_page_size(self, request):
+        size = parse_int(request.query_params.get(self.page_size_query_param))
+        if size is None or size < 1:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        if view is not None and getattr(view, 'ordering_fields', None):
+            ordering = OrderingFilter().get_ordering(request, queryset, view)
+        if ordering:
+            term = ordering[0]
+        elif self.rank_annotation in queryset.query.annotations:
+            term = f"-{self.rank_annotation}"
+        else:
+            term = self.default_ordering
+        return term.lstrip('-'), term.startswith('-')
+
+    def encode_cursor(self, ordering, value, pk, reverse):
+        if not isinstance(value, (int, float, str, type(None))):
+            value = str(value)
+        payload = json.dumps({'o': ordering, 'v': value, 'i': pk, 'r': int(reverse)})
+        return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, ordering, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(urlsafe_b64decode(padded.encode()))
+            if payload['o'] != ordering:
+                raise ValueError
+            value = payload['v']
+            field_name = ordering.lstrip('-')
+            try:
+                field = queryset.model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                field = None
+            if field is not None and value is not None:
+                value = field.to_python(value)
+            return value, int(payload['i']), bool(payload['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        field, descending = self.get_ordering(request, queryset, view)
+        self.ordering = f"-{field}" if descending else field
+        self.field = field
+
+        cursor = self.decode_cursor(request, self.ordering, queryset)
+        reverse = bool(cursor and cursor[2])
+        # Walking backwards flips both the comparison and the sort.
+        walk_descending = descending != reverse
+        lookup = 'lt' if walk_descending else 'gt'
+        sign = '-' if walk_descending else ''
+
+        if cursor:
+            value, pk, _ = cursor
+            queryset = queryset.filter(**{f"{field}__{lookup}e": value}).filter(
+                Q(**{f"{field}__{lookup}": value}) | Q(**{f"{self.tie_breaker}__{lookup}": pk})
+            )
+        queryset = queryset.order_by(f"{sign}{field}", f"{sign}{self.tie_breaker}")
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = rows
+        return rows
+
+    def _link(self, item, reverse):
+        url = self.request.build_absolute_uri()
+        cursor = self.encode_cursor(
+            self.ordering,
+            getattr(item, self.field),
+            getattr(item, self.tie_breaker),
+            reverse,
+        )
+        url = remove_query_param(url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,152 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils.module_loading import import_string
+
+from .helper import MONEY_QUANT, parse_int
+from .models import CartItem, Products, StockShard
+from .stock import stock_totals
+
+ZERO = Decimal("0.00")
+HUNDRED = Decimal(100)
+
+
+class PricingError(Exception):
+    pass
+
+
+def quantize_money(value):
+    return value.quantize(MONEY_QUANT, rounding=ROUND_HALF_UP)
+
+
+def discounted_unit_price(price, discount):
+    """
+    `price` less `discount` percent, rounded to the cent once per unit. The
+    discount is clamped to 0-100 so a bad value can't raise the price or
+    make it negative.
+    """
+    if not discount:
+        return price
+    percent = min(max(Decimal(str(discount)), ZERO), HUNDRED)
+    return quantize_money(price * (HUNDRED - percent) / HUNDRED)
+
+
+def no_tax(cart, address=None):
+    return ZERO
+
+
+def free_shipping(cart, address=None):
+    return ZERO
+
+
+class PricedLine:
+    __slots__ = ("product", "quantity", "item_id", "unit_price", "unit_discount", "subtotal", "total")
+
+    def __init__(self, product, quantity, item_id=None):
+        self.product = product
+        self.quantity = quantity
+        self.item_id = item_id
+        self.unit_price = discounted_unit_price(product.price, product.discount)
+        self.unit_discount = product.price - self.unit_price
+        self.subtotal = product.price * quantity
+        self.total = self.unit_price * quantity
+
+    def as_dict(self):
+        return {
+            "product_id": self.product.id,
+            "quantity": self.quantity,
+            "unit_price": self.unit_price,
+            "unit_discount": self.unit_discount,
+            "subtotal": self.subtotal,
+            "total": self.total,
+        }
+
+
+class PricedCart:
+    """
+    Priced lines plus totals. Line amounts are exact Decimal products of
+    cent-rounded unit prices, so every total is already whole cents; tax and
+    shipping come from the PRICING_TAX_CALCULATOR / PRICING_SHIPPING_CALCULATOR
+    callables `(cart, address) -> Decimal`.
+    """
+
+    def __init__(self, lines, address=None):
+        self.lines = lines
+        self.units = sum(line.quantity for line in lines)
+        self.subtotal = sum((line.subtotal for line in lines), ZERO)
+        self.merchandise = sum((line.total for line in lines), ZERO)
+        self.discount = self.subtotal - self.merchandise
+        self.tax = quantize_money(calculator("PRICING_TAX_CALCULATOR", no_tax)(self, address))
+        self.shipping = quantize_money(calculator("PRICING_SHIPPING_CALCULATOR", free_shipping)(self, address))
+        self.total = self.merchandise + self.tax + self.shipping
+
+    def as_dict(self):
+        return {
+            "lines": len(self.lines),
+            "units": self.units,
+            "subtotal": self.subtotal,
+            "discount": self.discount,
+            "tax": self.tax,
+            "shipping": self.shipping,
+            "total": self.total,
+        }
+
+
+def calculator(setting, default):
+    path = getattr(settings, setting, None)
+    return import_string(path) if path else default
+
+
+def fetch_products(product_ids, lock=False):
+    """
+    Every product in `product_ids` in one query, optionally row-locked in id
+    order. Sharded products (see core/stock.py) report the cached total of
+    their shards as stock, and are never locked: their shards are updated
+    instead, so they are read in a second, unlocked query.
+    """
+    has_shards = Exists(StockShard.objects.filter(product=OuterRef("pk")))
+    queryset = Products.objects.filter(id__in=product_ids).order_by("id")
+    if lock:
+        products = list(queryset.exclude(has_shards).select_for_update())
+        unlocked = set(product_ids) - {product.id for product in products}
+        sharded = list(Products.objects.filter(id__in=unlocked)) if unlocked else []
+        products += sharded
+    else:
+        products = list(queryset.annotate(has_shards=has_shards))
+        sharded = [product for product in products if product.has_shards]
+    if sharded:
+        totals = stock_totals([product.id for product in sharded])
+        for product in sharded:
+            product.stock = totals.get(product.id, product.stock)
+    return {product.id: product for product in products}
+
+
+def price_order_items(order_items, address=None, lock=False, check_stock=True):
+    """
+    Price normalized order items (see views.normalize_order_items) from a
+    single product fetch. Raises PricingError on the first invalid line.
+    """
+    product_ids = {parse_int(item["product_id"]) for item in order_items} - {None}
+    products = fetch_products(product_ids, lock=lock)
+    lines = []
+    for item in order_items:
+        product = products.get(parse_int(item["product_id"]))
+        quantity = item["quantity"]
+        if not product:
+            raise PricingError("Product Not Found...")
+        if quantity is None or quantity < 1:
+            raise PricingError("Invalid quantity.")
+        if check_stock and quantity > product.available:
+            raise PricingError(f"Insufficient stock for {product.title}.")
+        lines.append(PricedLine(product, quantity, item_id=item.get("item_id")))
+    return PricedCart(lines, address=address)
+
+
+def price_cart(user, address=None):
+    """Price `user`'s cart as it stands, lines and products in one query."""
+    items = CartItem.objects.filter(cart__user=user).select_related("product").order_by("id")
+    return PricedCart(
+        [PricedLine(item.product, item.quantity, item_id=item.id) for item in items],
+        address=address,
+    )
@@ -0,0 +1,104 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .category_tree import get_category_tree
+from .models import Image, Products
+from .serializers import CategorySerializer, ProductSerializer
+from .signals import products_bulk_changed
+
+
+# Columns that some write paths change with update() without touching
+# updated_at; they feed the detail validators alongside it.
+VERSION_FIELDS = ("stock", "sold", "rating", "review_count")
+
+
+def detail_cache():
+    return caches[getattr(settings, "PRODUCT_DETAIL_CACHE_ALIAS", "default")]
+
+
+def product_detail_key(product_id):
+    return f"core:product-detail:{product_id}"
+
+
+def get_product_detail(product_id, version=None):
+    """
+    Serialized ProductSerializer payload for one product, or None.
+
+    `version` is the product's current get_product_version(); an entry
+    cached under another version is dropped and rebuilt. Without a shared
+    cache, evictions only reach the worker that made the write, so this is
+    what keeps other workers from serving a stale product.
+
+    The nested category is re-rendered from the category tree on every hit,
+    so category edits and sibling product counts never stale an entry and
+    only Products/Image writes have to evict it.
+    """
+    key = product_detail_key(product_id)
+    entry = detail_cache().get(key)
+    if entry is not None and version is not None and (entry["updated_at"], entry["version"]) != version:
+        entry = None
+    if entry is None:
+        product = Products.objects.prefetch_related("imgs").filter(id=product_id).first()
+        if product is None:
+            return None
+        data = dict(ProductSerializer(product).data)
+        detail_cache().set(
+            key,
+            {
+                "data": data,
+                "updated_at": product.updated_at,
+                "version": [getattr(product, field) for field in VERSION_FIELDS],
+            },
+            getattr(settings, "PRODUCT_DETAIL_CACHE_TIMEOUT", 60 * 60),
+        )
+        return data
+
+    data = entry["data"]
+    category = data.get("category")
+    if category:
+        node = get_category_tree(required_id=category["id"]).node(category["id"])
+        if node is not None:
+            data["category"] = CategorySerializer().to_representation(node)
+    return data
+
+
+def get_product_version(product_id):
+    """
+    `(updated_at, [VERSION_FIELDS values])` for a product from a primary-key
+    lookup, or None if it doesn't exist. Always read from the database: a
+    cached entry may be stale in this worker.
+    """
+    row = Products.objects.filter(id=product_id).values_list("updated_at", *VERSION_FIELDS).first()
+    if row is None:
+        return None
+    return row[0], list(row[1:])
+
+
+def evict_product_detail(*product_ids):
+    keys = [product_detail_key(product_id) for product_id in product_ids]
+
+    def evict():
+        detail_cache().delete_many(keys)
+
+    evict()
+    transaction.on_commit(evict)
+
+
+@receiver(post_save, sender=Products)
+@receiver(post_delete, sender=Products)
+def product_changed(sender, instance=None, **kwargs):
+    evict_product_detail(instance.id)
+
+
+@receiver(products_bulk_changed)
+def products_changed_in_bulk(sender, product_ids=(), **kwargs):
+    evict_product_detail(*product_ids)
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def image_changed(sender, instance=None, **kwargs):
+    evict_product_detail(instance.product_id)
@@ -0,0 +1,108 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Manager
+from rest_framework import serializers
+
+
+class QueryPlan:
+    """
+    select_related/prefetch_related lookups (and post-fetch steps) needed
+    to render a serializer tree without per-row queries.
+    """
+
+    def __init__(self):
+        self.select_related = []
+        self.prefetch_related = []
+        self.post_fetch = []
+
+    def add(self, path, prefetched=False):
+        """Join `path` into the query, or prefetch it once below a prefetch."""
+        lookups = self.prefetch_related if prefetched else self.select_related
+        if path not in lookups:
+            lookups.append(path)
+
+    def prefetch(self, path):
+        self.add(path, prefetched=True)
+
+    def after_fetch(self, path, callback):
+        """Call `callback(instances)` with the loaded objects found at `path`."""
+        self.post_fetch.append((path, callback))
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related)
+        return queryset
+
+    def fetch(self, queryset):
+        rows = list(self.apply(queryset))
+        for path, callback in self.post_fetch:
+            instances = instances_at(rows, path)
+            if instances:
+                callback(instances)
+        return rows
+
+
+def instances_at(rows, path):
+    """Already-loaded related objects reached from `rows` through `path`."""
+    instances = list(rows)
+    for name in filter(None, path.split("__")):
+        found = []
+        for instance in instances:
+            value = getattr(instance, name, None)
+            if isinstance(value, Manager):
+                found.extend(value.all())
+            elif value is not None:
+                found.append(value)
+        instances = found
+    return instances
+
+
+def relation_field(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return field if field.is_relation else None
+
+
+def plan_serializer(serializer, plan, prefix="", prefetched=False):
+    """
+    Add the lookups `serializer` needs when rendered from objects reached
+    through `prefix`. Serializers can take over with a `plan_queries(plan,
+    prefix, prefetched)` method (e.g. tree- or snapshot-backed ones).
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    if hasattr(serializer, "plan_queries"):
+        serializer.plan_queries(plan, prefix, prefetched)
+        return
+    model = getattr(getattr(serializer, "Meta", None), "model", None)
+    if model is None:
+        return
+
+    for field in serializer.fields.values():
+        if field.write_only or not isinstance(field, serializers.BaseSerializer):
+            continue
+        if field.source == "*" or "." in field.source:
+            continue
+        relation = relation_field(model, field.source)
+        if relation is None:
+            continue
+        path = f"{prefix}{field.source}"
+        # Many-valued relations, and anything nested under one, are prefetched.
+        nested_prefetched = prefetched or relation.one_to_many or relation.many_to_many
+        plan.add(path, nested_prefetched)
+        plan_serializer(field, plan, f"{path}__", nested_prefetched)
+
+
+def plan_queries(serializer):
+    plan = QueryPlan()
+    plan_serializer(serializer, plan)
+    return plan
+
+
+def planned(serializer, queryset):
+    """Load `queryset` with `serializer`'s plan and bind it as the instance."""
+    serializer.instance = plan_queries(serializer).fetch(queryset)
+    return serializer
@@ -0,0 +1,137 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ProductRating, Products, Reviews
+from .signals import products_bulk_changed
+
+RATING_FIELDS = ["rating", "review_count", "updated_at"]
+# Marks a review loaded without its rating/product columns.
+UNKNOWN = object()
+
+
+def average_rating():
+    return Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=Cast("rating_sum", FloatField()) / F("rating_count"),
+        output_field=FloatField(),
+    )
+
+
+def synced_rating_values():
+    """Products.rating/review_count as derived from ProductRating rows."""
+    stats = ProductRating.objects.filter(product=OuterRef("pk"))
+    return {
+        "rating": Coalesce(Subquery(stats.annotate(average=average_rating()).values("average")[:1]), 0.0),
+        "review_count": Coalesce(Subquery(stats.values("rating_count")[:1]), 0),
+    }
+
+
+def sync_product_ratings(products):
+    """Copy the aggregates onto Products.rating/review_count in one UPDATE."""
+    products.update(**synced_rating_values(), updated_at=timezone.now())
+
+
+def apply_rating_change(product_id, rating, sign):
+    """Add (sign=1) or remove (sign=-1) one review of `rating` stars."""
+    changes = {
+        "rating_count": F("rating_count") + sign,
+        "rating_sum": F("rating_sum") + sign * rating,
+    }
+    if 1 <= rating <= 5:
+        changes[f"stars_{rating}"] = F(f"stars_{rating}") + sign
+
+    with transaction.atomic():
+        if sign > 0:
+            ProductRating.objects.bulk_create([ProductRating(product_id=product_id)], ignore_conflicts=True)
+        if not ProductRating.objects.filter(product_id=product_id).update(**changes):
+            return
+        sync_product_ratings(Products.objects.filter(id=product_id))
+        products_bulk_changed.send(sender=Products, product_ids=[product_id], fields=RATING_FIELDS)
+
+
+def rebuild_product_ratings():
+    """
+    Recompute every aggregate from Reviews in one grouped pass, then sync
+    Products. Returns the ids of products whose rating or count moved.
+    """
+    star_counts = {f"stars_{stars}": Count("id", filter=Q(rating=stars)) for stars in range(1, 6)}
+    rows = (
+        Reviews.objects.order_by()
+        .values("product_id")
+        .annotate(rating_sum=Sum("rating"), rating_count=Count("id"), **star_counts)
+    )
+    with transaction.atomic():
+        stats = [ProductRating(**row) for row in rows]
+        ProductRating.objects.exclude(product_id__in=Reviews.objects.values("product_id")).delete()
+        ProductRating.objects.bulk_create(
+            stats,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["rating_sum", "rating_count", *star_counts],
+        )
+        # Only rewrite (and bump updated_at on) products that are out of sync.
+        synced = synced_rating_values()
+        drifted = Products.objects.annotate(
+            synced_rating=synced["rating"], synced_review_count=synced["review_count"]
+        ).exclude(rating=F("synced_rating"), review_count=F("synced_review_count"))
+        changed = list(drifted.values_list("id", flat=True))
+        sync_product_ratings(Products.objects.filter(id__in=drifted.values("id")))
+        if changed:
+            products_bulk_changed.send(sender=Products, product_ids=changed, fields=RATING_FIELDS)
+    return changed
+
+
+def recount_product_rating(product_id):
+    """Rebuild one product's aggregates from its reviews."""
+    star_counts = {f"stars_{stars}": Count("id", filter=Q(rating=stars)) for stars in range(1, 6)}
+    row = Reviews.objects.filter(product_id=product_id).aggregate(
+        rating_sum=Coalesce(Sum("rating"), 0), rating_count=Count("id"), **star_counts
+    )
+    with transaction.atomic():
+        ProductRating.objects.update_or_create(product_id=product_id, defaults=row)
+        sync_product_ratings(Products.objects.filter(id=product_id))
+        products_bulk_changed.send(sender=Products, product_ids=[product_id], fields=RATING_FIELDS)
+
+
+@receiver(post_init, sender=Reviews)
+def remember_review_rating(sender, instance=None, **kwargs):
+    # What the aggregates currently count for this review. Read from
+    # __dict__ so deferred loads don't fetch the fields one row at a time.
+    if instance.pk is None:
+        instance._counted = None
+    elif "rating" in instance.__dict__ and "product_id" in instance.__dict__:
+        instance._counted = (instance.product_id, instance.rating)
+    else:
+        instance._counted = UNKNOWN
+
+
+@receiver(post_save, sender=Reviews)
+def review_saved(sender, instance=None, created=False, **kwargs):
+    current = (instance.product_id, instance.rating)
+    if created:
+        instance._counted = None
+    if instance._counted is UNKNOWN:
+        recount_product_rating(instance.product_id)
+    elif instance._counted != current:
+        if instance._counted is not None:
+            apply_rating_change(*instance._counted, -1)
+        apply_rating_change(*current, 1)
+    instance._counted = current
+
+
+@receiver(post_delete, sender=Reviews)
+def review_deleted(sender, instance=None, origin=None, **kwargs):
+    if isinstance(origin, Products):
+        # The product is going too; its ProductRating row cascades with it.
+        return
+    if instance._counted is UNKNOWN:
+        product_id = instance.product_id
+        transaction.on_commit(lambda: recount_product_rating(product_id))
+    elif instance._counted is not None:
+        apply_rating_change(*instance._counted, -1)
+    instance._counted = None
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ProductRating, Reviews
+from .ratings import average_rating
+from .serializers import ReviewSerializer
+
+
+def review_summary_key(product_id):
+    return f"core:review-summary:{product_id}"
+
+
+def build_review_summary(product_id):
+    """
+    Average, count and histogram from the ProductRating aggregates (the
+    average through ratings.average_rating, as for Products.rating) plus the
+    newest few reviews off the (product, created_at, id) index; neither
+    reads more than a handful of rows.
+    """
+    stats = ProductRating.objects.filter(product_id=product_id).annotate(average=average_rating()).first()
+    if stats is None:
+        stats = ProductRating(product_id=product_id)
+        stats.average = 0.0
+    recent = Reviews.objects.filter(product_id=product_id).order_by('-created_at', '-id')
+    recent = recent[:getattr(settings, "REVIEW_SUMMARY_RECENT", 3)]
+    return {
+        "average": stats.average,
+        "count": stats.rating_count,
+        "histogram": {str(stars): count for stars, count in stats.histogram.items()},
+        "recent": ReviewSerializer(recent, many=True).data,
+    }
+
+
+def get_review_summary(product_id):
+    key = review_summary_key(product_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_review_summary(product_id)
+        cache.set(key, summary, getattr(settings, "REVIEW_SUMMARY_CACHE_TIMEOUT", 10 * 60))
+    return summary
+
+
+def evict_review_summary(product_id):
+    key = review_summary_key(product_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_save, sender=Reviews)
+@receiver(post_delete, sender=Reviews)
+def review_changed(sender, instance=None, **kwargs):
+    evict_review_summary(instance.product_id)
@@ -0,0 +1,240 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+from .models import Products
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def search_tokens(terms):
+    tokens = []
+    for term in terms:
+        tokens.extend(token.lower() for token in WORD_RE.findall(term))
+    return tokens
+
+
+class ProductSearchBackend:
+    """
+    Full-text index over Products.title/description for one database vendor.
+
+    `install` must be idempotent: it runs from the migration and again after
+    every migrate to repair anything a table rebuild dropped.
+    """
+
+    vendor = None
+
+    def __init__(self):
+        self._available = set()
+
+    def install(self, connection):
+        raise NotImplementedError
+
+    def uninstall(self, connection):
+        raise NotImplementedError
+
+    def check_installed(self, connection):
+        raise NotImplementedError
+
+    def is_available(self, connection):
+        if connection.alias in self._available:
+            return True
+        if self.check_installed(connection):
+            self._available.add(connection.alias)
+            return True
+        return False
+
+    def search(self, queryset, tokens):
+        raise NotImplementedError
+
+
+class SQLiteFTS5Backend(ProductSearchBackend):
+    vendor = "sqlite"
+    table = f"{Products._meta.db_table}_fts"
+    triggers = ("ai", "ad", "au")
+
+    def _trigger_sql(self):
+        source = Products._meta.db_table
+        fts = self.table
+        insert_new = (
+            f"INSERT INTO {fts}(rowid, title, description) "
+            f"VALUES (new.id, new.title, coalesce(new.description, ''));"
+        )
+        delete_old = (
+            f"INSERT INTO {fts}({fts}, rowid, title, description) "
+            f"VALUES ('delete', old.id, old.title, coalesce(old.description, ''));"
+        )
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} "
+            f"BEGIN {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} "
+            f"BEGIN {delete_old} END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF title, description ON {source} "
+            f"BEGIN {delete_old} {insert_new} END",
+        ]
+
+    def _existing_triggers(self, cursor):
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+            [Products._meta.db_table],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def check_installed(self, connection):
+        with connection.cursor() as cursor:
+            existing = self._existing_triggers(cursor)
+        return all(f"{self.table}_{name}" in existing for name in self.triggers)
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+                    f"title, description, content='{Products._meta.db_table}', "
+                    f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+                )
+            except Exception:
+                # SQLite built without FTS5; searches fall back to icontains.
+                return False
+            if self.check_installed(connection):
+                return True
+            for statement in self._trigger_sql():
+                cursor.execute(statement)
+            # Triggers were missing (fresh install or a table rebuild), so the
+            # index may be behind the content table.
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+        return True
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            for name in self.triggers:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {self.table}_{name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+        self._available.discard(connection.alias)
+
+    def search(self, queryset, tokens):
+        match = " ".join('"%s"*' % token.replace('"', '""') for token in tokens)
+        source = Products._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s", [match]
+            )
+        ).annotate(
+            # bm25 is "lower is better"; negate it so rank sorts like ts_rank.
+            search_rank=RawSQL(
+                f"SELECT -bm25({self.table}, 10.0, 1.0) FROM {self.table} "
+                f"WHERE {self.table} MATCH %s AND rowid = {source}.id",
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+
+class PostgresFullTextBackend(ProductSearchBackend):
+    vendor = "postgresql"
+    column = "search_vector"
+    index = "product_search_vector_idx"
+    config = "english"
+
+    def check_installed(self, connection):
+        with connection.cursor() as cursor:
+            columns = connection.introspection.get_table_description(
+                cursor, Products._meta.db_table
+            )
+        return any(column.name == self.column for column in columns)
+
+    def install(self, connection):
+        source = Products._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"ALTER TABLE {source} ADD COLUMN IF NOT EXISTS {self.column} tsvector "
+                f"GENERATED ALWAYS AS ("
+                f"setweight(to_tsvector('{self.config}', coalesce(title, '')), 'A') || "
+                f"setweight(to_tsvector('{self.config}', coalesce(description, '')), 'B')"
+                f") STORED"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.index} ON {source} USING GIN ({self.column})"
+            )
+        return True
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {self.index}")
+            cursor.execute(
+                f"ALTER TABLE {Products._meta.db_table} DROP COLUMN IF EXISTS {self.column}"
+            )
+        self._available.discard(connection.alias)
+
+    def search(self, queryset, tokens):
+        tsquery = " & ".join(f"{token}:*" for token in tokens)
+        column = f"{Products._meta.db_table}.{self.column}"
+        return queryset.filter(
+            RawSQL(
+                f"{column} @@ to_tsquery(%s::regconfig, %s)",
+                [self.config, tsquery],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f"ts_rank_cd({column}, to_tsquery(%s::regconfig, %s))",
+                [self.config, tsquery],
+                output_field=FloatField(),
+            )
+        )
+
+
+SEARCH_BACKENDS = {
+    backend.vendor: backend
+    for backend in (SQLiteFTS5Backend(), PostgresFullTextBackend())
+}
+
+
+def get_search_backend(connection):
+    backend = SEARCH_BACKENDS.get(connection.vendor)
+    if backend is not None and backend.is_available(connection):
+        return backend
+    return None
+
+
+def install_search_backend(connection):
+    backend = SEARCH_BACKENDS.get(connection.vendor)
+    if backend is not None:
+        backend.install(connection)
+
+
+def uninstall_search_backend(connection):
+    backend = SEARCH_BACKENDS.get(connection.vendor)
+    if backend is not None:
+        backend.uninstall(connection)
+
+
+def install_search_backend_post_migrate(sender, using="default", **kwargs):
+    install_search_backend(connections[using])
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    `?search=` backed by the database's full-text index, ranked by relevance.
+
+    Results are ordered by `search_rank` unless the client passes an explicit
+    `ordering`. Falls back to the stock icontains search when no index exists.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        tokens = search_tokens(self.get_search_terms(request))
+        if not tokens:
+            return super().filter_queryset(request, queryset, view)
+
+        backend = get_search_backend(connections[queryset.db])
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        queryset = backend.search(queryset, tokens)
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by("-search_rank", "id")
+        return queryset
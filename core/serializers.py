@@ -1,7 +1,10 @@
 from rest_framework import serializers
-from .models import Products, Image, CartItem, AddressBook, Category, Reviews,Order_Item,Order,OTP, WishList
+from django.db.models import prefetch_related_objects
+from django.db.models.manager import BaseManager
+from .models import Products, ProductSnapshot, Image, CartItem, AddressBook, Category, Reviews,Order_Item,Order,OTP, WishList
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission
+from .category_tree import get_category_tree
 
 CustomUser = get_user_model()
 
@@ -9,6 +12,18 @@ class ImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = '__all__'
+        read_only_fields = ['urls']
+
+class ImageVariantSerializer(serializers.ModelSerializer):
+    """An image as its precomputed delivery URLs, one key per IMAGE_VARIANTS entry."""
+
+    class Meta:
+        model = Image
+        fields = ['id']
+
+    def to_representation(self, instance):
+        urls = instance.urls or instance.build_variant_urls()
+        return {'id': instance.id, **urls}
 
 class CategoryUploadSerializer(serializers.ModelSerializer):
     class Meta:
@@ -16,6 +31,11 @@ class CategoryUploadSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class CategorySerializer(serializers.ModelSerializer):
+    """
+    Read-only category rendering backed by the cached CategoryTree, so
+    nesting it under every product costs no queries.
+    """
+    children = serializers.SerializerMethodField()
     parents = serializers.SerializerMethodField()
     products_count = serializers.SerializerMethodField()
 
@@ -23,41 +43,150 @@ class CategorySerializer(serializers.ModelSerializer):
         model = Category
         fields = ['id', 'name', 'children', 'parents', 'products_count']
 
+    def get_attribute(self, instance):
+        # Nested as `category`: resolve through the FK id rather than loading
+        # the related row.
+        attname = f"{self.source}_id"
+        if len(self.source_attrs) == 1 and hasattr(instance, attname):
+            pk = getattr(instance, attname)
+            return None if pk is None else self.get_node(pk)
+        return super().get_attribute(instance)
+
+    def get_node(self, pk):
+        tree = getattr(self, '_tree', None)
+        if tree is None or pk not in tree:
+            tree = self._tree = get_category_tree(required_id=pk)
+        return tree.node(pk)
+
     def get_parents(self, obj):
-        parents = []
-        parent = obj.parent
-        while parent is not None:
-            parents.append({'id': parent.id, 'name': parent.name})
-            parent = parent.parent
-        return parents
+        node = self.get_node(obj.id)
+        return list(node.parents) if node else []
 
     def get_children(self, obj):
-        children = obj.children.all()
-        serializer = CategorySerializer(children, many=True)
-        return serializer.data
-    
+        node = self.get_node(obj.id)
+        return list(node.children) if node else []
+
     def get_products_count(self, obj):
-        return Products.objects.filter(category=obj).count()
+        node = self.get_node(obj.id)
+        return node.products_count if node else 0
+
+    def plan_queries(self, plan, prefix, prefetched):
+        # Rendered from the category tree; the relation is never loaded.
+        pass
+
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if isinstance(data, BaseManager) else data)
+        # Only rows without a usable snapshot need their images loaded.
+        if 'imgs' in self.child.fields:
+            self.child.prefetch_missing_images(products)
+        return [self.child.to_representation(product) for product in products]
+
+
+def query_param_set(request, name):
+    if request is None or name not in request.query_params:
+        return None
+    values = request.query_params.getlist(name)
+    return {part.strip() for value in values for part in value.split(',') if part.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    `?fields=`, `?exclude=` and `?expand=` for a serializer and anything it is
+    nested in. With `fields`, relations in `expandable_fields` render as
+    their primary key unless also named in `expand`.
+    """
+    expandable_fields = ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        only = query_param_set(request, 'fields')
+        exclude = query_param_set(request, 'exclude') or set()
+        expand = query_param_set(request, 'expand') or set()
 
-class ProductSerializer(serializers.ModelSerializer):
-    imgs = serializers.StringRelatedField(many=True, read_only=True)
+        if only is not None:
+            fields = {name: field for name, field in fields.items() if name in only or name in expand}
+        for name in exclude:
+            fields.pop(name, None)
+        if only is not None:
+            for name in self.expandable_fields:
+                if name in fields and name not in expand:
+                    fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        return fields
+
+    @classmethod
+    def prune(cls, data, request):
+        """Apply the same rules to an already rendered payload."""
+        only = query_param_set(request, 'fields')
+        exclude = query_param_set(request, 'exclude') or set()
+        expand = query_param_set(request, 'expand') or set()
+        if only is None and not exclude:
+            return data
+
+        pruned = {}
+        for name, value in data.items():
+            if (only is not None and name not in only and name not in expand) or name in exclude:
+                continue
+            if only is not None and name in cls.expandable_fields and name not in expand and isinstance(value, dict):
+                value = value.get('id')
+            pruned[name] = value
+        return pruned
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    imgs = ImageVariantSerializer(many=True, read_only=True)
     category = CategorySerializer()
+    expandable_fields = ('category',)
 
     class Meta:
         model = Products
         # fields = "__all__"
-        exclude = ['created_at', 'updated_at']
+        exclude = ['created_at', 'updated_at', 'reserved']
+        list_serializer_class = ProductListSerializer
+
+    def plan_queries(self, plan, prefix, prefetched):
+        plan.add(f"{prefix}snapshot", prefetched)
+        if 'imgs' in self.fields:
+            plan.after_fetch(prefix, self.prefetch_missing_images)
+
+    def prefetch_missing_images(self, products):
+        """Load images only for products that can't be emitted from a snapshot."""
+        missing = [product for product in products if self.get_snapshot(product) is None]
+        if missing:
+            prefetch_related_objects(missing, 'imgs')
+
+    def get_snapshot(self, instance):
+        """The select_related() snapshot, if it was loaded and is current."""
+        if not Products.snapshot.related.is_cached(instance):
+            return None
+        snapshot = Products.snapshot.related.get_cached_value(instance)
+        if snapshot is None or snapshot.version != ProductSnapshot.VERSION:
+            return None
+        return snapshot
+
+    def to_representation(self, instance):
+        snapshot = self.get_snapshot(instance)
+        if snapshot is None:
+            return super().to_representation(instance)
+
+        ret = {}
+        for field in self._readable_fields:
+            if isinstance(field, CategorySerializer):
+                node = field.get_attribute(instance)
+                ret['category'] = None if node is None else field.to_representation(node)
+            elif isinstance(field, serializers.DecimalField):
+                value = snapshot.data.get(field.field_name)
+                ret[field.field_name] = None if value is None else field.to_representation(value)
+            else:
+                ret[field.field_name] = snapshot.data.get(field.field_name)
+        return ret
 
 class ProductUploadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Products
         fields = '__all__'
 
-class SearchAutoCompleteSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Products
-        fields = ["id",'title']
-
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
 
@@ -134,8 +263,14 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = Order_Item
         fields = ['id', 'product', 'product_id', 'order', 'quantity']
 
+class OrderLineSerializer(serializers.ModelSerializer):
+    """An order line as purchased, from its own snapshot columns only."""
+    class Meta:
+        model = Order_Item
+        fields = ['id', 'product_id', 'title', 'unit_price', 'image', 'quantity']
+
 class OrderSerializer(serializers.ModelSerializer):
-    order_items = OrderItemSerializer(many=True, read_only=True)
+    order_items = OrderLineSerializer(many=True, read_only=True)
     # user = UserSerializer(read_only=True)
     address = serializers.SerializerMethodField(read_only=True)
     address_id = serializers.PrimaryKeyRelatedField(
@@ -153,6 +288,10 @@ class OrderSerializer(serializers.ModelSerializer):
             "zipcode": obj.address.zipcode
         }
 
+    def plan_queries(self, plan, prefix, prefetched):
+        plan.add(f"{prefix}address", prefetched)
+        plan.prefetch(f"{prefix}order_items")
+
 class OTPSerializer(serializers.ModelSerializer):
     class Meta:
         model = OTP
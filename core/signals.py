@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent after Products rows change through bulk_create()/update(), which skip
+# the per-instance model signals. Receivers get `product_ids` and `fields`,
+# the changed columns, or None when any column may have changed (like
+# post_save's update_fields).
+products_bulk_changed = Signal()
@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Image, Products, ProductSnapshot
+from .serializers import ProductSerializer
+from .signals import products_bulk_changed
+
+
+def render_snapshot_data(product):
+    serializer = ProductSerializer(product)
+    # The category block is rendered from the category tree at read time.
+    serializer.fields.pop("category")
+    data = dict(serializer.data)
+    data["category"] = product.category_id
+    return data
+
+
+def refresh_product_snapshots(product_ids, batch_size=500):
+    """Rebuild the snapshot rows for `product_ids` with one upsert per batch."""
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        products = Products.objects.filter(id__in=product_ids[start:start + batch_size]).prefetch_related("imgs")
+        snapshots = [
+            ProductSnapshot(
+                product=product,
+                data=render_snapshot_data(product),
+                version=ProductSnapshot.VERSION,
+            )
+            for product in products
+        ]
+        ProductSnapshot.objects.bulk_create(
+            snapshots,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["data", "version", "updated_at"],
+        )
+
+
+@receiver(post_save, sender=Products)
+def product_saved(sender, instance=None, **kwargs):
+    refresh_product_snapshots([instance.id])
+
+
+@receiver(products_bulk_changed)
+def products_changed_in_bulk(sender, product_ids=(), **kwargs):
+    # Deferred: bulk writers (order commits in particular) still hold the
+    # product row locks here, so re-rendering waits for the commit.
+    product_ids = list(product_ids)
+    transaction.on_commit(lambda: refresh_product_snapshots(product_ids))
+
+
+@receiver(post_save, sender=Image)
+def image_saved(sender, instance=None, **kwargs):
+    refresh_product_snapshots([instance.product_id])
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance=None, **kwargs):
+    # Deferred: when the product itself is being deleted, an upsert here
+    # would recreate a snapshot after the cascade already removed it.
+    product_id = instance.product_id
+    transaction.on_commit(lambda: refresh_product_snapshots([product_id]))
@@ -0,0 +1,351 @@
+import random
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Sum, When
+from django.db.models.functions import Now
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Products, StockReservation, StockShard
+from .signals import products_bulk_changed
+
+# Holds outlive their checkout session by this much, so a payment completed
+# in the session's last seconds still finds its stock held.
+RESERVATION_GRACE = timedelta(minutes=10)
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+class StockShardError(Exception):
+    pass
+
+
+def sum_quantities(lines):
+    quantities = Counter()
+    for product_id, quantity in lines:
+        quantities[product_id] += quantity
+    return quantities
+
+
+def per_product(quantities):
+    """A `Case` yielding each product's quantity (0 for any other row)."""
+    return Case(*(When(id=product_id, then=quantity) for product_id, quantity in quantities.items()), default=0)
+
+
+def available_for(quantities):
+    """Rows of `quantities`' products with that many units not yet held."""
+    enough = Q()
+    for product_id, quantity in quantities.items():
+        enough |= Q(id=product_id, stock__gte=F("reserved") + quantity)
+    return Products.objects.filter(enough)
+
+
+# Sharded stock: a hot product's units live in StockShard rows so concurrent
+# checkouts update different rows instead of queuing on the Products row.
+# Holds on a sharded product take units straight out of its shards rather
+# than raising Products.reserved.
+
+def stock_total_key(product_id):
+    return f"core:stock-total:{product_id}"
+
+
+def fetch_shards(product_ids):
+    """{product_id: [(shard_id, stock), ...]} for the sharded products among `product_ids`."""
+    shards = defaultdict(list)
+    rows = StockShard.objects.filter(product_id__in=product_ids).values_list("product_id", "id", "stock")
+    for product_id, shard_id, stock in rows:
+        shards[product_id].append((shard_id, stock))
+    return shards
+
+
+def unsharded(quantities, shards):
+    return {product_id: quantity for product_id, quantity in quantities.items() if product_id not in shards}
+
+
+def stock_totals(product_ids):
+    """Units left for each sharded product in `product_ids`, summed from its shards and cached."""
+    keys = {stock_total_key(product_id): product_id for product_id in product_ids}
+    totals = {keys[key]: total for key, total in cache.get_many(keys).items()}
+    missing = [product_id for product_id in product_ids if product_id not in totals]
+    if missing:
+        rows = (
+            StockShard.objects.filter(product_id__in=missing).order_by()
+            .values_list("product_id").annotate(total=Sum("stock"))
+        )
+        computed = dict(rows)
+        cache.set_many(
+            {stock_total_key(product_id): total for product_id, total in computed.items()},
+            getattr(settings, "STOCK_SHARD_TOTAL_CACHE_TIMEOUT", 60),
+        )
+        totals.update(computed)
+    return totals
+
+
+def evict_stock_totals(product_ids):
+    keys = [stock_total_key(product_id) for product_id in product_ids]
+
+    def evict():
+        cache.delete_many(keys)
+
+    evict()
+    transaction.on_commit(evict)
+
+
+def with_shard_flag(queryset):
+    """Annotate products with `has_shards`, in the same query."""
+    return queryset.annotate(has_shards=Exists(StockShard.objects.filter(product=OuterRef("pk"))))
+
+
+def available_stock(products):
+    """
+    {product_id: units a cart may claim} for `products` (loaded through
+    with_shard_flag): the shard total for sharded products, stock less held
+    units for the rest.
+    """
+    totals = stock_totals([product.id for product in products if product.has_shards])
+    return {product.id: totals.get(product.id, product.available) for product in products}
+
+
+def adjust_shard_stock(product_id, delta):
+    """
+    Restock (or write off, with a negative `delta`) a sharded product by
+    respreading its shards' total plus `delta` evenly; never below zero.
+    """
+    with transaction.atomic():
+        locked = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by("index"))
+        if not locked:
+            return
+        total = max(0, sum(shard.stock for shard in locked) + delta)
+        base, extra = divmod(total, len(locked))
+        for shard in locked:
+            shard.stock = base + (shard.index < extra)
+        StockShard.objects.bulk_update(locked, ["stock"])
+        evict_stock_totals([product_id])
+
+
+def take_from_shards(product_id, quantity, shards, sell=True):
+    """
+    Take `quantity` units of a sharded product, counting them as sold if
+    `sell`. Shards that looked big enough are tried in random order with a
+    conditional UPDATE; if none still is, the product's shards are locked
+    and drained in index order.
+    """
+    sold = quantity if sell else 0
+    candidates = [shard_id for shard_id, stock in shards if stock >= quantity]
+    random.shuffle(candidates)
+    for shard_id in candidates:
+        taken = StockShard.objects.filter(id=shard_id, stock__gte=quantity).update(
+            stock=F("stock") - quantity, sold=F("sold") + sold
+        )
+        if taken:
+            return
+
+    locked = list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by("index"))
+    if sum(shard.stock for shard in locked) < quantity:
+        raise InsufficientStock("Insufficient stock for one or more items.")
+    remaining = quantity
+    for shard in locked:
+        taken = min(shard.stock, remaining)
+        shard.stock -= taken
+        remaining -= taken
+    locked[0].sold += sold
+    StockShard.objects.bulk_update(locked, ["stock", "sold"])
+
+
+def return_to_shards(quantity, shards):
+    shard_id, _ = random.choice(shards)
+    StockShard.objects.filter(id=shard_id).update(stock=F("stock") + quantity)
+
+
+def decrement_stock(lines):
+    """
+    Take `(product_id, quantity)` pairs off stock and onto sold. Repeated
+    products are summed first, and units held by other checkouts are not
+    available. Unsharded products are updated together in one conditional
+    UPDATE; sharded ones take from their shards. Raises InsufficientStock if
+    any product is short, so call it inside the transaction that should
+    roll back.
+    """
+    quantities = sum_quantities(lines)
+    if not quantities:
+        return
+    shards = fetch_shards(list(quantities))
+    plain = unsharded(quantities, shards)
+    if plain:
+        taken = per_product(plain)
+        updated = available_for(plain).update(
+            stock=F("stock") - taken, sold=F("sold") + taken, updated_at=Now()
+        )
+        if updated != len(plain):
+            raise InsufficientStock("Insufficient stock for one or more items.")
+        products_bulk_changed.send(sender=Products, product_ids=list(plain), fields=["stock", "sold", "updated_at"])
+    for product_id in sorted(shards):
+        take_from_shards(product_id, quantities[product_id], shards[product_id])
+    if shards:
+        evict_stock_totals(list(shards))
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, "STOCK_RESERVATION_TTL", 60 * 60))
+
+
+def reserve_stock(session_id, lines, expires_at=None, user=None):
+    """
+    Hold `(product_id, quantity)` pairs for `user`'s checkout `session_id`
+    until `expires_at` (by default STOCK_RESERVATION_TTL plus
+    RESERVATION_GRACE from now). One conditional UPDATE claims every
+    unsharded product's units; if any product is short, nothing is held and
+    InsufficientStock is raised.
+    """
+    quantities = sum_quantities(lines)
+    if expires_at is None:
+        expires_at = timezone.now() + reservation_ttl() + RESERVATION_GRACE
+    with transaction.atomic():
+        shards = fetch_shards(list(quantities))
+        plain = unsharded(quantities, shards)
+        if plain:
+            updated = available_for(plain).update(reserved=F("reserved") + per_product(plain))
+            if updated != len(plain):
+                raise InsufficientStock("Insufficient stock for one or more items.")
+        for product_id in sorted(shards):
+            take_from_shards(product_id, quantities[product_id], shards[product_id], sell=False)
+        if shards:
+            evict_stock_totals(list(shards))
+        StockReservation.objects.bulk_create([
+            StockReservation(
+                session_id=session_id, user=user, product_id=product_id, quantity=quantity, expires_at=expires_at
+            )
+            for product_id, quantity in quantities.items()
+        ])
+
+
+def rename_reservation(old_session_id, session_id):
+    """Re-key a hold taken before its checkout session id was known."""
+    StockReservation.objects.filter(session_id=old_session_id).update(session_id=session_id)
+
+
+def release_reservations(reservations):
+    """
+    Drop the holds in the `reservations` queryset and hand their units back,
+    with one DELETE and one UPDATE for all unsharded products involved.
+    Returns the number of holds released.
+    """
+    with transaction.atomic():
+        held = list(reservations.select_for_update().values_list("id", "product_id", "quantity"))
+        if not held:
+            return 0
+        quantities = sum_quantities((product_id, quantity) for _, product_id, quantity in held)
+        StockReservation.objects.filter(id__in=[row[0] for row in held]).delete()
+        shards = fetch_shards(list(quantities))
+        plain = unsharded(quantities, shards)
+        if plain:
+            Products.objects.filter(id__in=list(plain)).update(reserved=F("reserved") - per_product(plain))
+        for product_id, product_shards in shards.items():
+            return_to_shards(quantities[product_id], product_shards)
+        if shards:
+            evict_stock_totals(list(shards))
+    return len(held)
+
+
+def release_session(session_id):
+    return release_reservations(StockReservation.objects.filter(session_id=session_id))
+
+
+def release_expired_reservations(now=None, batch_size=500):
+    """The sweeper: release every hold whose expiry has passed, `batch_size` at a time."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(expires_at__lte=now)
+            .order_by("expires_at")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not batch:
+            return released
+        released += release_reservations(StockReservation.objects.filter(id__in=batch, expires_at__lte=now))
+
+
+def shard_stock(product_id, shards):
+    """
+    Split a product's stock evenly across `shards` counters, or with
+    `shards=0` fold its shards back into Products.stock/sold. Refuses while
+    the product has active holds, which are accounted differently in the
+    two modes.
+    """
+    with transaction.atomic():
+        product = Products.objects.select_for_update().get(id=product_id)
+        if StockReservation.objects.filter(product_id=product_id).exists():
+            raise StockShardError(f"{product.title} has active stock reservations.")
+        existing = StockShard.objects.filter(product_id=product_id)
+        totals = existing.aggregate(stock=Sum("stock"), sold=Sum("sold"))
+        if totals["stock"] is not None:
+            product.stock = totals["stock"]
+            product.sold += totals["sold"]
+            existing.delete()
+        if shards:
+            base, extra = divmod(product.stock, shards)
+            StockShard.objects.bulk_create([
+                StockShard(product_id=product_id, index=index, stock=base + (index < extra))
+                for index in range(shards)
+            ])
+        # Not save(): the shards already hold these units (see product_stock_saved).
+        Products.objects.filter(id=product_id).update(stock=product.stock, sold=product.sold, updated_at=Now())
+        evict_stock_totals([product_id])
+        products_bulk_changed.send(sender=Products, product_ids=[product_id], fields=["stock", "sold", "updated_at"])
+    return product
+
+
+def sync_sharded_stock():
+    """
+    Copy shard totals into Products.stock and fold sold counts into
+    Products.sold, so listings, caches and exports see current numbers.
+    Returns the ids of products whose totals moved.
+    """
+    with transaction.atomic():
+        shards = list(StockShard.objects.select_for_update().values_list("product_id", "stock", "sold"))
+        stock = Counter()
+        sold = Counter()
+        for product_id, units, units_sold in shards:
+            stock[product_id] += units
+            sold[product_id] += units_sold
+        current = dict(Products.objects.filter(id__in=list(stock)).values_list("id", "stock"))
+        changed = [product_id for product_id in stock if sold[product_id] or current.get(product_id) != stock[product_id]]
+        if not changed:
+            return []
+        Products.objects.filter(id__in=changed).update(
+            stock=Case(*(When(id=product_id, then=stock[product_id]) for product_id in changed)),
+            sold=F("sold") + per_product({product_id: sold[product_id] for product_id in changed}),
+            updated_at=Now(),
+        )
+        StockShard.objects.filter(sold__gt=0).update(sold=0)
+    products_bulk_changed.send(sender=Products, product_ids=changed, fields=["stock", "sold", "updated_at"])
+    return changed
+
+
+@receiver(post_init, sender=Products)
+def remember_product_stock(sender, instance=None, **kwargs):
+    # Read from __dict__ so deferred loads don't fetch stock row by row.
+    instance._loaded_stock = instance.__dict__.get("stock") if instance.pk is not None else None
+
+
+@receiver(post_save, sender=Products)
+def product_stock_saved(sender, instance=None, created=False, update_fields=None, **kwargs):
+    """
+    A saved stock edit (admin, API) on a sharded product would be
+    overwritten by the next sync; apply it to the shards as a delta instead.
+    """
+    if update_fields is not None and "stock" not in update_fields:
+        return
+    loaded, instance._loaded_stock = instance._loaded_stock, instance.stock
+    if created or loaded is None or instance.stock == loaded:
+        return
+    if StockShard.objects.filter(product_id=instance.pk).exists():
+        adjust_shard_stock(instance.pk, instance.stock - loaded)
@@ -1,12 +1,55 @@
 import json
+from datetime import timedelta
 from decimal import Decimal
-from unittest.mock import patch
+import csv
+import gzip
+import os
+import tempfile
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
 
+import cloudinary
+import stripe
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from .models import AddressBook, Cart, CartItem, Category, Order, Products, WishList
+from .autocomplete import product_title_index
+from .models import (
+    AddressBook,
+    Cart,
+    CartItem,
+    Category,
+    IdempotencyKey,
+    Image,
+    Order,
+    Order_Item,
+    Products,
+    ProductRating,
+    ProductSnapshot,
+    Reviews,
+    StockReservation,
+    StockShard,
+    WishList,
+)
+from .idempotency import request_fingerprint
+from .importers import ProductImporter
+from .pricing import discounted_unit_price, fetch_products
+from .search import get_search_backend
+from .signals import products_bulk_changed
+from .stock import release_session, reserve_stock, stock_totals
+from .serializers import ProductSerializer
 
 
 class CheckoutFlowTests(APITestCase):
@@ -181,6 +224,1680 @@ class CheckoutFlowTests(APITestCase):
         self.assertFalse(CartItem.objects.filter(id=cart_item.id).exists())
 
 
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Shoes")
+        self.trail = self._product("Trail Runner", "Grippy outsole for mud", "TR-1")
+        self.road = self._product("Road Shoe", "Light trainer for running on asphalt", "RD-1")
+        self._product("Sandal", "Open toe summer wear", "SD-1")
+
+    def _product(self, title, description, sku):
+        return Products.objects.create(
+            title=title,
+            description=description,
+            price=Decimal("10.00"),
+            category=self.category,
+            sku=sku,
+        )
+
+    def _ids(self, response):
+        return [row["id"] for row in response.data["results"]]
+
+    def test_search_ranks_title_matches_first_and_uses_prefixes(self):
+        self.assertIsNotNone(get_search_backend(connection))
+        response = self.client.get("/api/products/?search=run")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._ids(response), [self.trail.id, self.road.id])
+
+    def test_search_index_follows_updates_and_deletes(self):
+        self.road.title = "Asphalt Racer"
+        self.road.save()
+        self.trail.delete()
+
+        response = self.client.get("/api/products/?search=racer")
+        self.assertEqual(self._ids(response), [self.road.id])
+
+        response = self.client.get("/api/products/?search=grippy")
+        self.assertEqual(self._ids(response), [])
+
+    def test_cursor_pages_keep_relevance_order(self):
+        ids = []
+        url = "/api/products/?search=run&pagination=cursor&limit=1"
+        while url:
+            response = self.client.get(url)
+            ids.extend(self._ids(response))
+            url = response.data["next"]
+
+        self.assertEqual(ids, [self.trail.id, self.road.id])
+
+    def test_explicit_ordering_overrides_relevance(self):
+        response = self.client.get("/api/products/?search=run&ordering=-title")
+
+        self.assertEqual(self._ids(response), [self.trail.id, self.road.id])
+        response = self.client.get("/api/products/?search=run&ordering=title")
+        self.assertEqual(self._ids(response), [self.road.id, self.trail.id])
+
+
+class SearchAutoCompleteTests(APITestCase):
+    def setUp(self):
+        product_title_index.reset()
+        self.category = Category.objects.create(name="Shoes")
+        for index, title in enumerate(
+            ["Shoe Horn", "Red Shoe", "Horseshoe", "Shoe Horn", "Sandal"]
+        ):
+            self._product(title, f"AC-{index}")
+
+    def _product(self, title, sku):
+        return Products.objects.create(
+            title=title, price=Decimal("5.00"), category=self.category, sku=sku
+        )
+
+    def _titles(self, query):
+        response = self.client.get("/api/autocomplete/", {"query": query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row["title"] for row in response.data]
+
+    def test_ranks_prefix_then_word_prefix_then_substring(self):
+        self.assertEqual(self._titles("shoe"), ["Shoe Horn", "Red Shoe", "Horseshoe"])
+        self.assertEqual(self._titles(""), [])
+
+    def test_index_follows_product_writes_without_queries(self):
+        self._titles("shoe")
+        with self.captureOnCommitCallbacks(execute=True):
+            boot = self._product("Shoe Box", "AC-9")
+            Products.objects.get(title="Red Shoe").delete()
+
+        with self.assertNumQueries(0):
+            titles = self._titles("shoe")
+        self.assertEqual(titles, ["Shoe Box", "Shoe Horn", "Horseshoe"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            boot.title = "Boot"
+            boot.save()
+        self.assertEqual(self._titles("bo"), ["Boot"])
+
+    def test_substring_matches_for_long_and_short_queries(self):
+        self.assertEqual(self._titles("rseSh"), ["Horseshoe"])
+        self.assertEqual(self._titles("rs"), ["Horseshoe"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Products.objects.filter(title="Horseshoe").get().delete()
+        self.assertEqual(self._titles("rseSh"), [])
+        self.assertNotIn("rse", product_title_index._trigrams)
+
+
+class ProductKeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Shoes")
+        self.products = [
+            Products.objects.create(
+                title=f"Shoe {index}",
+                price=Decimal(price),
+                category=self.category,
+                sku=f"KS-{index}",
+            )
+            for index, price in enumerate(["5.00", "3.00", "5.00", "1.00", "5.00", "2.00"])
+        ]
+
+    def _walk(self, url, link="next"):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            ids.extend(row["id"] for row in response.data["results"])
+            url = response.data[link]
+            pages += 1
+        return ids, pages
+
+    def test_cursor_pages_follow_ordering_with_id_tie_breaker(self):
+        expected = [
+            product.id
+            for product in sorted(self.products, key=lambda p: (-p.price, -p.id))
+        ]
+
+        ids, pages = self._walk("/api/products/?pagination=cursor&ordering=-price&limit=2")
+
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+        ids, _ = self._walk("/api/products/?pagination=cursor&limit=4")
+        self.assertEqual(ids, [product.id for product in reversed(self.products)])
+
+    def test_cursor_filter_starts_a_range_on_the_ordering_column(self):
+        response = self.client.get("/api/products/?pagination=cursor&ordering=-price&limit=abc")
+        self.assertEqual(len(response.data["results"]), 5)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data["next"])
+        page_query = next(query["sql"] for query in queries if "LIMIT" in query["sql"])
+        self.assertIn('"core_products"."price" <= ', page_query)
+
+    def test_previous_cursor_walks_back_to_first_page(self):
+        response = self.client.get("/api/products/?pagination=cursor&ordering=price&limit=2")
+        first_page = [row["id"] for row in response.data["results"]]
+        self.assertIsNone(response.data["previous"])
+
+        response = self.client.get(response.data["next"])
+        response = self.client.get(response.data["previous"])
+
+        self.assertEqual([row["id"] for row in response.data["results"]], first_page)
+        self.assertIsNone(response.data["previous"])
+
+    def test_cursor_from_another_ordering_is_rejected(self):
+        response = self.client.get("/api/products/?pagination=cursor&ordering=price&limit=2")
+        cursor_url = response.data["next"]
+
+        response = self.client.get(cursor_url.replace("ordering=price", "ordering=title"))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CategoryTreeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.root = Category.objects.create(name="Apparel")
+        self.shoes = Category.objects.create(name="Shoes", parent=self.root)
+        self.trail = Category.objects.create(name="Trail", parent=self.shoes)
+        for index in range(3):
+            self._product(f"Trail {index}", self.trail)
+        self._product("Plain Shoe", self.shoes)
+
+    def _product(self, title, category):
+        return Products.objects.create(
+            title=title, price=Decimal("9.00"), category=category, sku=title
+        )
+
+    def test_categories_render_ancestors_children_and_counts(self):
+        response = self.client.get("/api/categories/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        by_id = {row["id"]: row for row in response.data}
+        self.assertEqual(by_id[self.root.id]["children"], [self.shoes.id])
+        self.assertEqual(
+            by_id[self.trail.id]["parents"],
+            [
+                {"id": self.shoes.id, "name": "Shoes"},
+                {"id": self.root.id, "name": "Apparel"},
+            ],
+        )
+        self.assertEqual(by_id[self.trail.id]["products_count"], 3)
+        self.assertEqual(by_id[self.shoes.id]["products_count"], 1)
+
+    def test_product_listing_nests_category_without_per_row_queries(self):
+        self.client.get("/api/products/?limit=100")
+
+        # ETag aggregate, COUNT and the page with snapshots; the category
+        # tree is cached.
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/products/?limit=100")
+
+        self.assertEqual(len(response.data["results"]), 4)
+        self.assertEqual(response.data["results"][0]["category"]["name"], "Trail")
+
+    def test_tree_is_invalidated_by_category_and_product_writes(self):
+        self.client.get("/api/categories/")
+        Category.objects.create(name="Road", parent=self.shoes)
+        self._product("Road 1", self.shoes)
+
+        response = self.client.get("/api/categories/")
+
+        by_id = {row["id"]: row for row in response.data}
+        self.assertEqual(len(by_id[self.shoes.id]["children"]), 2)
+        self.assertEqual(by_id[self.shoes.id]["products_count"], 2)
+
+
+class CategoryPathTests(APITestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name="Apparel")
+        self.shoes = Category.objects.create(name="Shoes", parent=self.root)
+        self.trail = Category.objects.create(name="Trail", parent=self.shoes)
+        self.bags = Category.objects.create(name="Bags")
+        self.trail_shoe = self._product("Trail Shoe", self.trail)
+        self.plain_shoe = self._product("Plain Shoe", self.shoes)
+        self._product("Tote", self.bags)
+
+    def _product(self, title, category):
+        return Products.objects.create(
+            title=title, price=Decimal("9.00"), category=category, sku=title
+        )
+
+    def test_category_filter_includes_subcategories(self):
+        response = self.client.get("/api/products/?category=Shoes")
+
+        ids = {row["id"] for row in response.data["results"]}
+        self.assertEqual(ids, {self.trail_shoe.id, self.plain_shoe.id})
+
+    def test_moving_a_category_rewrites_descendant_paths(self):
+        self.shoes.parent = self.bags
+        self.shoes.save()
+
+        self.trail.refresh_from_db()
+        self.assertEqual(self.trail.path, f"/{self.bags.id}/{self.shoes.id}/{self.trail.id}/")
+        self.assertEqual(
+            list(self.trail.get_ancestors().order_by("id")), [self.shoes, self.bags]
+        )
+        self.assertEqual(list(self.root.get_descendants()), [])
+
+    def test_child_of_a_stale_parent_gets_the_current_path(self):
+        stale_shoes = Category.objects.get(id=self.shoes.id)
+        self.shoes.parent = self.bags
+        self.shoes.save()
+
+        boots = Category.objects.create(name="Boots", parent=stale_shoes)
+
+        self.assertEqual(boots.path, f"/{self.bags.id}/{self.shoes.id}/{boots.id}/")
+
+        self.bags.parent = self.trail
+        with self.assertRaises(ValueError):
+            self.bags.save()
+
+
+class ProductFacetsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.shoes = Category.objects.create(name="Shoes")
+        self.trail = Category.objects.create(name="Trail", parent=self.shoes)
+        self.bags = Category.objects.create(name="Bags")
+        self._product("Trail Runner", self.trail, "30.00", 4.5)
+        self._product("Road Runner", self.shoes, "80.00", 3.2)
+        self._product("Runner Tote", self.bags, "10.00", 5)
+        self._product("Sandal", self.shoes, "600.00", 0)
+
+    def _product(self, title, category, price, rating):
+        return Products.objects.create(
+            title=title,
+            price=Decimal(price),
+            rating=rating,
+            category=category,
+            sku=title,
+        )
+
+    def test_facets_follow_listing_filters_in_one_query(self):
+        get_search_backend(connection)
+        with self.assertNumQueries(4):
+            # ?category paths, one grouped facet query, then the category tree.
+            response = self.client.get("/api/products/facets/?category=Shoes&search=runner")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        facets = response.data
+        self.assertEqual(facets["count"], 2)
+        self.assertEqual(
+            {row["name"]: row["count"] for row in facets["categories"]},
+            {"Trail": 1, "Shoes": 1},
+        )
+        self.assertEqual([row["count"] for row in facets["price_buckets"]], [0, 1, 1, 0, 0, 0])
+        self.assertEqual(
+            {row["min_rating"]: row["count"] for row in facets["rating_buckets"]},
+            {5: 0, 4: 1, 3: 1, 2: 0, 1: 0, 0: 0},
+        )
+        self.assertEqual(facets["price_range"], {"min": Decimal("30.00"), "max": Decimal("80.00")})
+
+    def test_facets_are_cached_per_filter_set_until_catalog_changes(self):
+        self.client.get("/api/products/facets/?min_price=20")
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/products/facets/?min_price=20&page=3")
+        self.assertEqual(response.data["count"], 3)
+
+        self._product("Boot", self.shoes, "45.00", 4)
+        response = self.client.get("/api/products/facets/?min_price=20")
+        self.assertEqual(response.data["count"], 4)
+
+    def test_facets_cached_before_a_write_commits_are_retired(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._product("Boot", self.shoes, "45.00", 4)
+            # Another request caching facets mid-transaction, under the new version.
+            with patch("core.facets.compute_facets", return_value={"count": "stale"}):
+                self.client.get("/api/products/facets/?min_price=20")
+
+        response = self.client.get("/api/products/facets/?min_price=20")
+        self.assertEqual(response.data["count"], 4)
+
+
+class ProductDetailCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("30.00"), category=self.category, sku="TR"
+        )
+        self.url = f"/api/product/{self.product.id}"
+
+    def test_hot_detail_is_served_from_one_version_lookup(self):
+        first = self.client.get(self.url)
+
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.data["title"], "Trail Runner")
+
+    def test_entry_cached_by_another_worker_is_rebuilt_when_stale(self):
+        self.client.get(self.url)
+        # A write whose eviction only reached another worker's cache.
+        with patch("core.product_cache.evict_product_detail"):
+            self.product.price = Decimal("25.00")
+            self.product.save()
+
+        self.assertEqual(self.client.get(self.url).data["price"], Decimal("25.00"))
+
+    def test_product_and_category_writes_show_up(self):
+        self.client.get(self.url)
+        self.product.price = Decimal("25.00")
+        self.product.save()
+        self.category.name = "Running"
+        self.category.save()
+        Products.objects.create(
+            title="Road Runner", price=Decimal("30.00"), category=self.category, sku="RR"
+        )
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data["price"], Decimal("25.00"))
+        self.assertEqual(response.data["category"]["name"], "Running")
+        self.assertEqual(response.data["category"]["products_count"], 2)
+
+    def test_missing_product_returns_empty_body(self):
+        response = self.client.get("/api/product/999999")
+
+        self.assertEqual(response.data, {})
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("30.00"), category=self.category, sku="TR"
+        )
+
+    def test_product_detail_revalidates_with_etag(self):
+        url = f"/api/product/{self.product.id}"
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.product.price = Decimal("25.00")
+        self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_sparse_detail_representations_have_their_own_etag(self):
+        url = f"/api/product/{self.product.id}"
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.get(f"{url}?fields=id", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"id": self.product.id})
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_stock_updates_move_detail_and_listing_etags(self):
+        url = f"/api/product/{self.product.id}"
+        detail_etag = self.client.get(url)["ETag"]
+        listing_etag = self.client.get("/api/products/")["ETag"]
+
+        # A bulk write that leaves updated_at alone.
+        Products.objects.filter(id=self.product.id).update(stock=3)
+        products_bulk_changed.send(sender=Products, product_ids=[self.product.id], fields=["stock"])
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=detail_etag).status_code, status.HTTP_200_OK)
+        response = self.client.get("/api/products/", HTTP_IF_NONE_MATCH=listing_etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_listing_etag_depends_on_filters_and_contents(self):
+        response = self.client.get("/api/products/?min_price=10")
+        etag = response["ETag"]
+
+        response = self.client.get("/api/products/?min_price=10", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get("/api/products/?min_price=20", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.product.delete()
+        response = self.client.get("/api/products/?min_price=10", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_listings_carry_no_last_modified_and_cursor_pages_skip_the_aggregate(self):
+        response = self.client.get("/api/products/")
+        self.assertFalse(response.has_header("Last-Modified"))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/products/?pagination=cursor")
+        self.assertFalse(response.has_header("ETag"))
+        self.assertFalse(any("MAX(" in query["sql"] for query in queries))
+
+    def test_categories_etag_is_answered_from_the_cached_tree(self):
+        etag = self.client.get("/api/categories/")["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Category.objects.create(name="Bags")
+        response = self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ProductSnapshotTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("30.00"), category=self.category, sku="TR"
+        )
+
+    def test_snapshot_payload_matches_full_serialization(self):
+        product = Products.objects.select_related("snapshot").get(id=self.product.id)
+        self.assertIsNotNone(ProductSerializer().get_snapshot(product))
+
+        from_snapshot = ProductSerializer(product).data
+        full = ProductSerializer(Products.objects.get(id=self.product.id)).data
+
+        self.assertEqual(list(from_snapshot), list(full))
+        self.assertEqual(from_snapshot, full)
+        self.assertIsInstance(from_snapshot["price"], Decimal)
+
+    def test_snapshot_follows_product_writes(self):
+        self.product.title = "Trail Runner 2"
+        self.product.save()
+
+        response = self.client.get("/api/products/")
+
+        self.assertEqual(response.data["results"][0]["title"], "Trail Runner 2")
+
+    def test_outdated_snapshots_are_ignored_and_rebuilt_by_command(self):
+        ProductSnapshot.objects.update(version=0, data={})
+        response = self.client.get("/api/products/")
+        self.assertEqual(response.data["results"][0]["title"], "Trail Runner")
+
+        call_command("rebuild_product_snapshots", stdout=StringIO())
+
+        snapshot = ProductSnapshot.objects.get(product=self.product)
+        self.assertEqual(snapshot.version, ProductSnapshot.VERSION)
+        self.assertEqual(snapshot.data["title"], "Trail Runner")
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(
+            email="sparse@example.com", password="secret123"
+        )
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner",
+            description="Grippy",
+            price=Decimal("30.00"),
+            category=self.category,
+            sku="TR",
+        )
+
+    def test_listing_returns_only_requested_fields_without_snapshot_join(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/products/?fields=id,title,price,category")
+
+        row = response.data["results"][0]
+        self.assertEqual(
+            row,
+            {
+                "id": self.product.id,
+                "title": "Trail Runner",
+                "price": Decimal("30.00"),
+                "category": self.category.id,
+            },
+        )
+        page_query = queries.captured_queries[-1]["sql"]
+        self.assertNotIn("core_productsnapshot", page_query)
+        self.assertNotIn("description", page_query)
+
+    def test_expand_and_exclude(self):
+        response = self.client.get("/api/products/?fields=id,category&expand=category")
+        self.assertEqual(response.data["results"][0]["category"]["name"], "Shoes")
+
+        response = self.client.get("/api/products/?exclude=description,imgs")
+        row = response.data["results"][0]
+        self.assertNotIn("description", row)
+        self.assertEqual(row["category"]["name"], "Shoes")
+
+    def test_detail_and_cart_apply_the_same_rules(self):
+        response = self.client.get(f"/api/product/{self.product.id}?fields=title,category")
+        self.assertEqual(response.data, {"title": "Trail Runner", "category": self.category.id})
+
+        CartItem.objects.create(cart=Cart.objects.get(user=self.customer), product=self.product)
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.get("/api/cart/?fields=id,title")
+        self.assertEqual(
+            response.data[0]["product"], {"id": self.product.id, "title": "Trail Runner"}
+        )
+
+
+@patch.object(cloudinary.config(), "cloud_name", "eshop-test")
+class ImageVariantTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("30.00"), category=self.category, sku="TR"
+        )
+
+    def test_variant_urls_are_stored_on_save_and_exposed_as_imgs(self):
+        image = Image.objects.create(product=self.product, image="imgs/trail")
+
+        image.refresh_from_db()
+        self.assertEqual(set(image.urls), {"thumbnail", "medium", "full"})
+        self.assertIn("w_200", image.urls["thumbnail"])
+        self.assertIn("imgs/trail", image.urls["full"])
+
+        with patch.object(Image, "build_variant_urls") as build:
+            response = self.client.get("/api/products/")
+        build.assert_not_called()
+        self.assertEqual(
+            response.data["results"][0]["imgs"], [{"id": image.id, **image.urls}]
+        )
+
+
+class ProductBulkImportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@example.com", password="secret123"
+        )
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("30.00"), category=self.category, sku="TR"
+        )
+
+    def test_csv_upsert_by_sku_with_row_errors(self):
+        feed = (
+            "sku,title,price,stock,category\n"
+            "TR,Trail Runner 2,35.00,4,Shoes\n"
+            "RD,Road Runner,50.00,,Shoes\n"
+            "BAD,Bad Price,-1,1,Shoes\n"
+            "HAT,Sun Hat,10.00,1,Hats\n"
+        )
+        self.client.force_authenticate(user=self.admin)
+        self.client.get(f"/api/product/{self.product.id}")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/upload/products/bulk/",
+                {"file": SimpleUploadedFile("feed.csv", feed.encode(), content_type="text/csv")},
+                format="multipart",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(response.data["updated"], 1)
+        self.assertEqual(response.data["error_count"], 2)
+        self.assertEqual([error["row"] for error in response.data["errors"]], [3, 4])
+        self.assertIn("price", response.data["errors"][0]["errors"])
+        self.assertEqual(response.data["errors"][1]["errors"], {"category": ["Unknown category."]})
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.title, self.product.stock), ("Trail Runner 2", 4))
+        self.assertEqual(Products.objects.get(sku="RD").stock, 0)
+        self.assertEqual(self.product.snapshot.data["title"], "Trail Runner 2")
+        detail = self.client.get(f"/api/product/{self.product.id}")
+        self.assertEqual(detail.data["title"], "Trail Runner 2")
+
+    def test_import_products_command_reads_ndjson(self):
+        rows = [
+            {"sku": "RD", "title": "Road Runner", "price": "50.00", "category": "Shoes"},
+            {"sku": "TR", "title": "Trail Runner", "price": "32.00", "category": "Shoes"},
+        ]
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as feed:
+            feed.write("\n".join(json.dumps(row) for row in rows) + "\n{not json}\n")
+        self.addCleanup(os.remove, feed.name)
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command("import_products", feed.name, chunk_size=1, stdout=stdout, stderr=stderr)
+
+        self.assertIn("Created 1, updated 1, 1 rows rejected.", stdout.getvalue())
+        self.assertIn("Row 3", stderr.getvalue())
+        self.assertEqual(Products.objects.get(sku="TR").price, Decimal("32.00"))
+
+    def test_reimport_only_updates_supplied_columns(self):
+        Products.objects.filter(id=self.product.id).update(
+            stock=50, discount=20, weight=3, description="keep me"
+        )
+        self.client.force_authenticate(user=self.admin)
+
+        response = self.client.post(
+            "/api/upload/products/bulk/",
+            {"file": SimpleUploadedFile("feed.csv", b"sku,title,price,category\nTR,X,12.00,Shoes\n")},
+            format="multipart",
+        )
+
+        self.assertEqual(response.data["updated"], 1)
+        self.product.refresh_from_db()
+        self.assertEqual(
+            (self.product.title, self.product.price, self.product.stock, self.product.discount,
+             self.product.weight, self.product.description),
+            ("X", Decimal("12.00"), 50, 20, 3, "keep me"),
+        )
+
+
+class LocalUploadClient:
+    """IMAGE_UPLOAD_CLIENT stand-in: "uploads" by naming the resource after the file."""
+
+    def upload(self, file, **options):
+        if file.name.startswith("broken"):
+            raise ValueError("Upload rejected")
+        public_id = f"{options['folder']}{file.name.rsplit('.', 1)[0]}"
+        return cloudinary.CloudinaryResource(public_id, version="1", format="jpg", type="upload", resource_type="image")
+
+
+@patch.object(cloudinary.config(), "cloud_name", "eshop-test")
+@override_settings(IMAGE_UPLOAD_CLIENT="core.tests.LocalUploadClient")
+class BulkImageUploadTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@example.com", password="secret123"
+        )
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("30.00"), category=self.category, sku="TR"
+        )
+        self.client.force_authenticate(user=self.admin)
+
+    def files(self, *names):
+        return [SimpleUploadedFile(name, b"jpeg-bytes", content_type="image/jpeg") for name in names]
+
+    def test_uploads_many_files_and_reports_failures(self):
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/upload/images/",
+                {"product": self.product.id, "images": self.files("front.jpg", "broken.jpg", "side.jpg")},
+                format="multipart",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["errors"], [{"file": "broken.jpg", "error": "Upload rejected"}])
+        self.assertEqual(len(response.data["images"]), 2)
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith('INSERT INTO "core_image"')]
+        self.assertEqual(len(inserts), 1)
+
+        image = Image.objects.order_by("id").first()
+        self.assertEqual(image.image.public_id, "imgs/front")
+        self.assertIn("w_200", image.urls["thumbnail"])
+        listing = self.client.get("/api/products/")
+        self.assertEqual([img["id"] for img in listing.data["results"][0]["imgs"]], [i["id"] for i in response.data["images"]])
+
+    def test_non_numeric_product_is_a_400(self):
+        response = self.client.post(
+            "/api/upload/images/", {"product": "abc", "images": self.files("front.jpg")}, format="multipart"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {"product": ["Product not found."]})
+
+    def test_async_upload_needs_a_shared_cache(self):
+        response = self.client.post(
+            "/api/upload/images/?async=1",
+            {"product": self.product.id, "images": self.files("front.jpg")},
+            format="multipart",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("async", response.data)
+        self.assertFalse(Image.objects.exists())
+
+    def test_async_upload_returns_job_and_finishes_in_background(self):
+        job_cache = tempfile.TemporaryDirectory()
+        self.addCleanup(job_cache.cleanup)
+        shared = {"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": job_cache.name}}
+        with override_settings(CACHES=shared), \
+                patch("core.image_uploads.submit_job", side_effect=lambda function, *args: function(*args)):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    "/api/upload/images/?async=1",
+                    {"product": self.product.id, "images": self.files("front.jpg")},
+                    format="multipart",
+                )
+
+            job = self.client.get(f"/api/upload/images/jobs/{response.data['job']}/")
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(job.data["status"], "done")
+        self.assertEqual(job.data["images"][0]["id"], Image.objects.get().id)
+
+
+class ProductExportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(
+            email="partner@example.com", password="secret123"
+        )
+        shoes = Category.objects.create(name="Shoes")
+        hats = Category.objects.create(name="Hats")
+        self.runner = Products.objects.create(
+            title="Trail Runner", description='Grippy, "light"', price=Decimal("30.00"), category=shoes, sku="TR"
+        )
+        self.boot = Products.objects.create(title="Hiking Boot", price=Decimal("90.00"), category=shoes, sku="HB")
+        Products.objects.create(title="Sun Hat", price=Decimal("10.00"), category=hats, sku="SH")
+        self.client.force_authenticate(user=self.customer)
+
+    def test_csv_export_applies_product_filters_in_one_product_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/products/export/?category=Shoes&ordering=-price")
+            body = b"".join(response.streaming_content).decode()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        product_queries = [q for q in queries.captured_queries if 'FROM "core_products"' in q["sql"]]
+        self.assertEqual(len(product_queries), 1)
+        rows = list(csv.DictReader(body.splitlines()))
+        self.assertEqual([row["sku"] for row in rows], ["HB", "TR"])
+        self.assertEqual(rows[1]["description"], 'Grippy, "light"')
+        self.assertEqual(rows[1]["category"], "Shoes")
+
+    def test_ndjson_export_is_gzipped_when_accepted(self):
+        response = self.client.get(
+            "/api/products/export/?output=ndjson&search=runner", HTTP_ACCEPT_ENCODING="gzip"
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        lines = gzip.decompress(b"".join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines][0] | {"created_at": None, "updated_at": None},
+            {
+                "id": self.runner.id, "sku": "TR", "title": "Trail Runner",
+                "description": 'Grippy, "light"', "price": "30.00", "discount": 0.0,
+                "stock": 0, "sold": 0, "rating": 0.0, "review_count": 0, "weight": 0.0,
+                "category_id": self.runner.category_id, "category": "Shoes",
+                "created_at": None, "updated_at": None,
+            },
+        )
+        self.assertEqual(len(lines), 1)
+
+
+class ProductRatingAggregateTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(
+            email="reviewer@example.com", password="secret123"
+        )
+        self.other = get_user_model().objects.create_user(
+            email="other-reviewer@example.com", password="secret123"
+        )
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("30.00"), category=self.category, sku="TR"
+        )
+
+    def test_review_writes_maintain_aggregates(self):
+        self.client.force_authenticate(user=self.customer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/api/reviews/?id={self.product.id}", {"body": "Great", "rating": 5}, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            review = Reviews.objects.create(product=self.product, user=self.other, body="Meh", rating=2)
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating, self.product.review_count), (3.5, 2))
+        self.assertEqual(self.product.snapshot.data["rating"], 3.5)
+
+        review.rating = 4
+        review.save()
+        stats = ProductRating.objects.get(product=self.product)
+        self.assertEqual((stats.rating_sum, stats.rating_count), (9, 2))
+        self.assertEqual(stats.histogram, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+
+        Reviews.objects.get(id=review.id).delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating, self.product.review_count), (5.0, 1))
+        self.assertEqual(ProductRating.objects.get(product=self.product).stars_4, 0)
+
+        self.product.delete()
+        self.assertFalse(ProductRating.objects.exists())
+
+    def test_rebuild_command_reconciles_drift(self):
+        Reviews.objects.create(product=self.product, user=self.customer, body="Good", rating=4)
+        unreviewed = Products.objects.create(
+            title="Sun Hat", price=Decimal("10.00"), category=self.category, sku="SH", rating=4.9, review_count=12
+        )
+        ProductRating.objects.filter(product=self.product).update(rating_sum=40, rating_count=3)
+        Products.objects.filter(id=self.product.id).update(rating=1.0)
+
+        with self.assertNumQueries(10), self.captureOnCommitCallbacks(execute=True):
+            call_command("rebuild_product_ratings", stdout=StringIO())
+
+        self.product.refresh_from_db()
+        unreviewed.refresh_from_db()
+        self.assertEqual((self.product.rating, self.product.review_count), (4.0, 1))
+        self.assertEqual((unreviewed.rating, unreviewed.review_count), (0.0, 0))
+        self.assertEqual(ProductRating.objects.get(product=self.product).stars_4, 1)
+        self.assertEqual(unreviewed.snapshot.data["review_count"], 0)
+
+
+class ReviewCursorPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("30.00"), category=self.category, sku="TR"
+        )
+        self.reviews = [
+            Reviews.objects.create(
+                product=self.product,
+                user=get_user_model().objects.create_user(email=f"r{number}@example.com", password="secret123"),
+                body=f"{stars} stars",
+                rating=stars,
+            )
+            for number, stars in enumerate((5, 4, 4, 2, 5, 3, 1))
+        ]
+
+    def test_cursor_pages_walk_newest_first_with_summary(self):
+        response = self.client.get(f"/api/reviews/?id={self.product.id}&pagination=cursor&limit=4")
+
+        newest_first = [review.id for review in reversed(self.reviews)]
+        self.assertEqual([row["id"] for row in response.data["results"]], newest_first[:4])
+        summary = response.data["summary"]
+        self.assertEqual(summary["count"], 7)
+        self.assertAlmostEqual(summary["average"], 24 / 7)
+        self.product.refresh_from_db()
+        self.assertEqual(summary["average"], self.product.rating)
+        self.assertEqual(summary["histogram"], {"1": 1, "2": 1, "3": 1, "4": 2, "5": 2})
+        self.assertEqual([row["id"] for row in summary["recent"]], newest_first[:3])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(response.data["next"])
+        self.assertEqual([row["id"] for row in response.data["results"]], newest_first[4:])
+        self.assertIsNone(response.data["next"])
+
+    def test_summary_is_evicted_on_review_writes(self):
+        url = f"/api/reviews/?id={self.product.id}&pagination=cursor"
+        self.client.get(url)
+
+        self.reviews[-1].delete()
+        response = self.client.get(url)
+
+        self.assertEqual(response.data["summary"]["count"], 6)
+        self.assertEqual(response.data["summary"]["recent"][0]["id"], self.reviews[-2].id)
+
+
+class CartSummaryTests(APITestCase):
+    def setUp(self):
+        # Summaries are only cached in a cache every worker shares.
+        shared_cache = tempfile.TemporaryDirectory()
+        self.addCleanup(shared_cache.cleanup)
+        shared = override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": shared_cache.name}
+        })
+        shared.enable()
+        self.addCleanup(shared.disable)
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(
+            email="cart@example.com", password="secret123"
+        )
+        self.category = Category.objects.create(name="Shoes")
+        self.runner = Products.objects.create(
+            title="Trail Runner", price=Decimal("19.99"), category=self.category, sku="TR", stock=10, discount=10
+        )
+        self.sock = Products.objects.create(
+            title="Wool Sock", price=Decimal("5.00"), category=self.category, sku="WS", stock=10
+        )
+        cart = Cart.objects.get(user=self.customer)
+        CartItem.objects.create(cart=cart, product=self.runner, quantity=3)
+        CartItem.objects.create(cart=cart, product=self.sock, quantity=2)
+        self.client.force_authenticate(user=self.customer)
+
+    def test_summary_is_computed_in_one_pricing_query_then_cached(self):
+        # The cart id lookup, then the priced lines.
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/cart/summary/")
+
+        self.assertEqual(
+            response.data,
+            {
+                "lines": 2,
+                "units": 5,
+                "subtotal": Decimal("69.97"),
+                "discount": Decimal("6.00"),
+                "tax": Decimal("0.00"),
+                "shipping": Decimal("0.00"),
+                "total": Decimal("63.97"),
+            },
+        )
+        with self.assertNumQueries(0):
+            badge = self.client.get("/api/cart/?total_quantity=1")
+        self.assertEqual(badge.data, {"total_quantity": 2})
+
+    def test_cart_and_price_changes_evict_the_summary(self):
+        self.client.get("/api/cart/summary/")
+
+        self.client.post("/api/cart/", {"id": self.sock.id, "q": 1}, format="json")
+        self.assertEqual(self.client.get("/api/cart/summary/").data["units"], 6)
+
+        self.sock.price = Decimal("6.00")
+        self.sock.save()
+        self.assertEqual(self.client.get("/api/cart/summary/").data["subtotal"], Decimal("77.97"))
+
+        self.client.delete("/api/cart/", {"id": CartItem.objects.get(product=self.runner).id}, format="json")
+        self.assertEqual(self.client.get("/api/cart/summary/").data["lines"], 1)
+
+    def test_process_local_cache_is_not_used_for_summaries(self):
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.client.get("/api/cart/summary/")
+            with self.assertNumQueries(1):
+                response = self.client.get("/api/cart/summary/")
+        self.assertEqual(response.data["units"], 5)
+
+
+class CartBatchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(
+            email="batch@example.com", password="secret123"
+        )
+        self.category = Category.objects.create(name="Shoes")
+        self.products = [
+            Products.objects.create(
+                title=f"Product {number}", price=Decimal("10.00"), category=self.category, sku=f"P{number}", stock=5
+            )
+            for number in range(4)
+        ]
+        self.cart = Cart.objects.get(user=self.customer)
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1)
+        self.client.force_authenticate(user=self.customer)
+
+    def cart_lines(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list("product_id", "quantity"))
+
+    def test_operations_apply_in_one_transaction(self):
+        first, second, third, fourth = (product.id for product in self.products)
+        operations = [
+            {"op": "add", "id": first, "q": 2},
+            {"op": "set", "id": second, "q": 4},
+            {"op": "add", "id": third, "q": 1},
+            {"op": "add", "id": third, "q": 1},
+            {"op": "add", "id": fourth, "q": 1},
+            {"op": "remove", "id": fourth},
+        ]
+        self.client.get("/api/cart/summary/")
+
+        # savepoint, cart lock, products, lines, insert, update, release
+        with self.assertNumQueries(7):
+            response = self.client.post("/api/cart/batch/", {"operations": operations}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row["quantity"] for row in response.data["results"]], [3, 4, 1, 2, 1, 0])
+        self.assertEqual(self.cart_lines(), {first: 3, second: 4, third: 2})
+        self.assertEqual(self.client.get("/api/cart/summary/").data["units"], 9)
+
+    def test_failures_roll_back_unless_partial(self):
+        first, second = self.products[0].id, self.products[1].id
+        operations = [
+            {"op": "remove", "id": first},
+            {"op": "set", "id": second, "q": 6},
+            {"op": "add", "id": 999, "q": 1},
+        ]
+
+        response = self.client.post("/api/cart/batch/", {"operations": operations}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.data["applied"])
+        self.assertEqual(
+            [row["status"] for row in response.data["results"]], ["ok", "error", "error"]
+        )
+        self.assertEqual(self.cart_lines(), {first: 1, second: 1})
+
+        response = self.client.post(
+            "/api/cart/batch/", {"operations": operations, "partial": True}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.cart_lines(), {second: 1})
+
+
+class PlannedSerializationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(
+            email="planned@example.com", password="secret123"
+        )
+        parent = Category.objects.create(name="Apparel")
+        self.category = Category.objects.create(name="Shoes", parent=parent)
+        self.cart = Cart.objects.get(user=self.customer)
+        self.client.force_authenticate(user=self.customer)
+
+    def add_lines(self, count):
+        start = Products.objects.count()
+        for number in range(start, start + count):
+            product = Products.objects.create(
+                title=f"Product {number}", price=Decimal("10.00"), category=self.category, sku=f"P{number}", stock=5
+            )
+            Image.objects.create(product=product, image=f"imgs/p{number}")
+            CartItem.objects.create(cart=self.cart, product=product)
+            WishList.objects.create(user=self.customer, product=product)
+
+    def query_counts(self):
+        counts = []
+        for url in ("/api/cart/", "/api/wishlist/"):
+            self.client.get(url)  # warm the category tree
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            counts.append(len(queries.captured_queries))
+        return counts
+
+    @patch.object(cloudinary.config(), "cloud_name", "eshop-test")
+    def test_query_count_does_not_grow_with_lines(self):
+        self.add_lines(2)
+        small = self.query_counts()
+        self.add_lines(8)
+        self.assertEqual(self.query_counts(), small)
+        self.assertEqual(small, [1, 1])
+
+        # Without snapshots the images are loaded in one extra query.
+        ProductSnapshot.objects.all().delete()
+        self.assertEqual(self.query_counts(), [2, 2])
+        response = self.client.get("/api/cart/")
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(len(response.data[0]["product"]["imgs"]), 1)
+        self.assertEqual(response.data[0]["product"]["category"]["parents"][0]["name"], "Apparel")
+
+
+def flat_rate_shipping(cart, address=None):
+    return Decimal("4.99") if cart.merchandise < 50 else Decimal("0.00")
+
+
+def state_sales_tax(cart, address=None):
+    return cart.merchandise * Decimal("0.0825") if address is not None and address.state == "TX" else Decimal("0.00")
+
+
+@override_settings(
+    PRICING_TAX_CALCULATOR="core.tests.state_sales_tax",
+    PRICING_SHIPPING_CALCULATOR="core.tests.flat_rate_shipping",
+)
+class PricingEngineTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(
+            email="pricing@example.com", password="secret123"
+        )
+        self.category = Category.objects.create(name="Shoes")
+        self.runner = Products.objects.create(
+            title="Trail Runner", price=Decimal("19.99"), category=self.category, sku="TR", stock=10, discount=15
+        )
+        self.sock = Products.objects.create(
+            title="Wool Sock", price=Decimal("5.00"), category=self.category, sku="WS", stock=10
+        )
+        self.address = AddressBook.objects.create(
+            user=self.customer,
+            fullName="Test Customer",
+            address="123 Market Street",
+            city="Austin",
+            state="TX",
+            zipcode="73301",
+            phone="+15125550100",
+            default_address=True,
+        )
+        self.order_items = [
+            {"product_id": self.runner.id, "quantity": 2},
+            {"product_id": self.sock.id, "quantity": 1},
+        ]
+        self.client.force_authenticate(user=self.customer)
+
+    def test_order_total_applies_discount_tax_and_shipping(self):
+        # 19.99 less 15% = 16.99 a unit; 2 x 16.99 + 5.00 = 38.98 merchandise,
+        # 3.22 tax (8.25%), 4.99 shipping under 50.00.
+        with patch("core.pricing.fetch_products", wraps=fetch_products) as fetch:
+            response = self.client.post(
+                "/api/orders/",
+                {"address_id": self.address.id, "payment": "COD", "total": "47.19", "order_items": self.order_items},
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(Order.objects.get().total, Decimal("47.19"))
+        fetch.assert_called_once_with({self.runner.id, self.sock.id}, lock=True)
+
+    @override_settings(STRIPE_SECRET_KEY="sk_test")
+    def test_stripe_session_charges_engine_prices(self):
+        session = SimpleNamespace(id="cs_test_pricing", url="https://checkout.test/cs_test_pricing")
+        with patch("core.views.stripe.checkout.Session.create", return_value=session) as create:
+            response = self.client.post(
+                "/api/payments/create-checkout-session/",
+                {"address_id": self.address.id, "order_items": self.order_items},
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        kwargs = create.call_args.kwargs
+        self.assertEqual(
+            [(item["price_data"]["product_data"]["name"], item["price_data"]["unit_amount"], item["quantity"])
+             for item in kwargs["line_items"]],
+            [("Trail Runner", 1699, 2), ("Wool Sock", 500, 1), ("Tax", 322, 1), ("Shipping", 499, 1)],
+        )
+        self.assertEqual(kwargs["metadata"]["total"], "47.19")
+
+    def test_discounts_outside_0_to_100_are_clamped(self):
+        self.assertEqual(discounted_unit_price(Decimal("19.99"), -20), Decimal("19.99"))
+        self.assertEqual(discounted_unit_price(Decimal("19.99"), 150), Decimal("0.00"))
+
+    @override_settings(STRIPE_SECRET_KEY="sk_test")
+    def test_paid_session_snapshots_the_prices_it_charged(self):
+        session = SimpleNamespace(id="cs_test_snapshot", url="https://checkout.test/cs_test_snapshot")
+        with patch("core.views.stripe.checkout.Session.create", return_value=session) as create:
+            self.client.post(
+                "/api/payments/create-checkout-session/",
+                {"address_id": self.address.id, "order_items": self.order_items},
+                format="json",
+            )
+        Products.objects.filter(id=self.runner.id).update(price=Decimal("24.99"), discount=0)
+
+        paid = StripeSession(
+            session_id="cs_test_snapshot",
+            payment_status="paid",
+            metadata=create.call_args.kwargs["metadata"],
+            payment_intent={"id": "pi_snapshot"},
+        )
+        with patch("core.views.stripe.checkout.Session.retrieve", return_value=paid):
+            response = self.client.get("/api/payments/session-status/?session_id=cs_test_snapshot")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertEqual(
+            dict(Order_Item.objects.values_list("product_id", "unit_price")),
+            {self.runner.id: Decimal("16.99"), self.sock.id: Decimal("5.00")},
+        )
+
+
+class OrderCommitTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(email="commit@example.com", password="secret123")
+        self.category = Category.objects.create(name="Shoes")
+        self.products = [
+            Products.objects.create(
+                title=f"Shoe {n}", price=Decimal("10.00"), category=self.category, sku=f"SH-{n}", stock=5
+            )
+            for n in range(20)
+        ]
+        self.address = AddressBook.objects.create(
+            user=self.customer,
+            fullName="Test Customer",
+            address="123 Market Street",
+            city="Austin",
+            state="TX",
+            zipcode="73301",
+            phone="+15125550100",
+            default_address=True,
+        )
+        self.client.force_authenticate(user=self.customer)
+
+    def _order(self, lines):
+        total = sum(Decimal("10.00") * quantity for _, quantity in lines)
+        return self.client.post(
+            "/api/orders/",
+            {
+                "address_id": self.address.id,
+                "payment": "COD",
+                "total": str(total),
+                "order_items": [{"product_id": product.id, "quantity": quantity} for product, quantity in lines],
+            },
+            format="json",
+        )
+
+    def _order_queries(self, lines):
+        with CaptureQueriesContext(connection) as queries:
+            response = self._order(lines)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_order_lines(self):
+        one_line = self._order_queries([(self.products[0], 1)])
+        twenty_lines = self._order_queries([(product, 2) for product in self.products])
+
+        self.assertEqual(twenty_lines, one_line)
+        self.products[0].refresh_from_db()
+        self.assertEqual((self.products[0].stock, self.products[0].sold), (2, 3))
+        self.assertEqual(Order.objects.last().order_items.count(), 20)
+
+    def test_snapshots_are_refreshed_after_the_order_commits(self):
+        product = self.products[0]
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            self._order([(product, 1)])
+        self.assertFalse([q for q in queries.captured_queries if "core_productsnapshot" in q["sql"]])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ProductSnapshot.objects.get(product=product).data["stock"], 4)
+
+    def test_order_moves_the_product_validators(self):
+        product = self.products[0]
+        url = f"/api/product/{product.id}"
+        etag = self.client.get(url)["ETag"]
+        updated_at = product.updated_at
+
+        self._order([(product, 2)])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["stock"], 3)
+        product.refresh_from_db()
+        self.assertGreater(product.updated_at, updated_at)
+
+    def test_repeated_lines_are_checked_against_combined_stock(self):
+        product = self.products[0]
+        response = self._order([(product, 3), (product, 3)])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        product.refresh_from_db()
+        self.assertEqual((product.stock, product.sold), (5, 0))
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(STRIPE_SECRET_KEY="sk_test", STRIPE_WEBHOOK_SECRET="whsec_test")
+class StockReservationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(email="hold@example.com", password="secret123")
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Flash Sale Shoe", price=Decimal("10.00"), category=self.category, sku="FS-1", stock=3
+        )
+        self.address = AddressBook.objects.create(
+            user=self.customer,
+            fullName="Test Customer",
+            address="123 Market Street",
+            city="Austin",
+            state="TX",
+            zipcode="73301",
+            phone="+15125550100",
+            default_address=True,
+        )
+        self.other_customer = get_user_model().objects.create_user(email="hold2@example.com", password="secret123")
+        self.order_items = [{"product_id": self.product.id, "quantity": 2}]
+        self.client.force_authenticate(user=self.customer)
+
+    def _checkout(self, session_id, expire=None, address=None):
+        # By default Stripe refuses to expire earlier sessions, so their holds stay.
+        expire = expire or Mock(side_effect=stripe.InvalidRequestError("Session is not open.", None))
+        session = SimpleNamespace(id=session_id, url=f"https://checkout.test/{session_id}")
+        with patch("core.views.stripe.checkout.Session.create", return_value=session) as create, \
+                patch("core.views.stripe.checkout.Session.expire", expire):
+            response = self.client.post(
+                "/api/payments/create-checkout-session/",
+                {"address_id": (address or self.address).id, "order_items": self.order_items},
+                format="json",
+            )
+        return response, create
+
+    def test_checkout_holds_stock_until_the_paid_session_becomes_an_order(self):
+        response, create = self._checkout("cs_hold_1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.assertIn("expires_at", create.call_args.kwargs)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved), (3, 2))
+        self.assertEqual(
+            list(StockReservation.objects.values_list("session_id", "quantity")), [("cs_hold_1", 2)]
+        )
+
+        # Only one unit is left to other checkouts and COD orders.
+        self.client.force_authenticate(user=self.other_customer)
+        other_address = AddressBook.objects.get(id=self.address.id)
+        other_address.pk, other_address.user, other_address.default_address = None, self.other_customer, True
+        other_address.save()
+        response, create = self._checkout("cs_hold_2", address=other_address)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {"error": "Insufficient stock for Flash Sale Shoe."})
+        create.assert_not_called()
+        self.client.force_authenticate(user=self.customer)
+        response = self.client.post(
+            "/api/orders/",
+            {"address_id": self.address.id, "payment": "COD", "total": "20.00", "order_items": self.order_items},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        session = StripeSession(
+            session_id="cs_hold_1",
+            payment_status="paid",
+            metadata={
+                "user_id": str(self.customer.id),
+                "address_id": str(self.address.id),
+                "total": "20.00",
+                "order_items": json.dumps(self.order_items),
+            },
+            payment_intent={"id": "pi_hold_1"},
+        )
+        with patch("core.views.stripe.checkout.Session.retrieve", return_value=session):
+            response = self.client.get("/api/payments/session-status/?session_id=cs_hold_1")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold, self.product.reserved), (1, 2, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_returning_customer_replaces_their_open_checkout(self):
+        self._checkout("cs_first")
+
+        expire = Mock()
+        response, _ = self._checkout("cs_second", expire=expire)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        expire.assert_called_once_with("cs_first")
+        self.assertEqual(
+            list(StockReservation.objects.values_list("session_id", "quantity")), [("cs_second", 2)]
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 2)
+
+    def test_expired_holds_are_released_by_webhook_and_sweeper(self):
+        self._checkout("cs_expired")
+        self._checkout("cs_abandoned")
+        self.order_items = [{"product_id": self.product.id, "quantity": 1}]
+        self._checkout("cs_abandoned")
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 3)
+
+        event = {"type": "checkout.session.expired", "data": {"object": {"id": "cs_expired"}}}
+        with patch("core.views.stripe.Webhook.construct_event", return_value=event):
+            response = self.client.post("/api/payments/webhook/", data="{}", content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 1)
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command("release_expired_reservations", stdout=StringIO())
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved), (3, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_held_units_are_not_offered_or_overwritten(self):
+        self._checkout("cs_held")
+        response = self.client.post(
+            "/api/cart/batch/", {"operations": [{"op": "add", "id": self.product.id, "q": 2}]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.product.refresh_from_db()
+        self.product.stock = 1
+        with self.assertRaises(ValidationError):
+            self.product.full_clean()
+        feed = SimpleUploadedFile("feed.csv", b"sku,title,price,stock,category\nFS-1,Flash Sale Shoe,10.00,1,Shoes\n")
+        report = ProductImporter().run(feed, "csv")
+        self.assertEqual((report["updated"], list(report["errors"][0]["errors"])), (0, ["stock"]))
+        self.assertEqual(Products.objects.get(id=self.product.id).stock, 3)
+
+
+class ShardedStockTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(email="shards@example.com", password="secret123")
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Hot Shoe", price=Decimal("10.00"), category=self.category, sku="HOT-1", stock=10, sold=5
+        )
+        self.address = AddressBook.objects.create(
+            user=self.customer,
+            fullName="Test Customer",
+            address="123 Market Street",
+            city="Austin",
+            state="TX",
+            zipcode="73301",
+            phone="+15125550100",
+            default_address=True,
+        )
+        self.client.force_authenticate(user=self.customer)
+        call_command("shard_stock", self.product.id, shards=4, stdout=StringIO())
+
+    def _order(self, quantity):
+        return self.client.post(
+            "/api/orders/",
+            {
+                "address_id": self.address.id,
+                "payment": "COD",
+                "total": str(Decimal("10.00") * quantity),
+                "order_items": [{"product_id": self.product.id, "quantity": quantity}],
+            },
+            format="json",
+        )
+
+    def _shards(self):
+        return list(StockShard.objects.filter(product=self.product).order_by("index").values_list("stock", flat=True))
+
+    def test_orders_take_from_shards_and_sync_folds_totals_back(self):
+        self.assertEqual(self._shards(), [3, 3, 2, 2])
+
+        self.assertEqual(self._order(3).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(self._shards()), 7)
+        # No shard holds 6 units any more, so this drains several.
+        self.assertEqual(self._order(6).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sum(self._shards()), 1)
+        self.assertEqual(self._order(2).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(stock_totals([self.product.id]), {self.product.id: 1})
+
+        # The Products row is left alone until the shards are synced.
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold), (10, 5))
+        call_command("sync_stock_shards", stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold), (1, 14))
+
+        call_command("shard_stock", self.product.id, shards=0, stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold), (1, 14))
+        self.assertEqual(self._shards(), [])
+
+    def test_holds_on_sharded_products_come_out_of_the_shards(self):
+        reserve_stock("cs_sharded", [(self.product.id, 4)])
+        self.assertEqual(sum(self._shards()), 6)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 0)
+
+        release_session("cs_sharded")
+        self.assertEqual(sum(self._shards()), 10)
+        self.assertEqual(StockShard.objects.aggregate(sold=Sum("sold"))["sold"], 0)
+
+    def test_restocks_and_cart_checks_go_through_the_shards(self):
+        self.assertEqual(self._order(4).status_code, status.HTTP_201_CREATED)
+        # The admin still sees the synced 10 and restocks by 5.
+        product = Products.objects.get(id=self.product.id)
+        product.stock = 15
+        product.save()
+        self.assertEqual(sum(self._shards()), 11)
+        feed = SimpleUploadedFile("feed.csv", b"sku,title,price,stock,category\nHOT-1,Hot Shoe,10.00,25,Shoes\n")
+        ProductImporter().run(feed, "csv")
+        self.assertEqual(sum(self._shards()), 21)
+
+        call_command("sync_stock_shards", stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.sold), (21, 9))
+
+        StockShard.objects.filter(product=self.product).update(stock=1)
+        response = self.client.post("/api/cart/", {"id": self.product.id, "q": 5}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.put("/api/cart/", {"id": self.product.id, "q": 5}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OrderHistoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(email="history@example.com", password="secret123")
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Trail Runner", price=Decimal("20.00"), category=self.category, sku="TR-H", stock=10, discount=10
+        )
+        with patch.object(cloudinary.config(), "cloud_name", "eshop-test"):
+            self.image = Image.objects.create(product=self.product, image="imgs/trail")
+        self.address = AddressBook.objects.create(
+            user=self.customer,
+            fullName="Test Customer",
+            address="123 Market Street",
+            city="Austin",
+            state="TX",
+            zipcode="73301",
+            phone="+15125550100",
+            default_address=True,
+        )
+        self.client.force_authenticate(user=self.customer)
+
+    def _order(self, quantity=1):
+        response = self.client.post(
+            "/api/orders/",
+            {
+                "address_id": self.address.id,
+                "payment": "COD",
+                "total": str(Decimal("18.00") * quantity),
+                "order_items": [{"product_id": self.product.id, "quantity": quantity}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return response.data["id"]
+
+    def test_lines_keep_their_purchase_time_price_title_and_image(self):
+        order_id = self._order(quantity=2)
+        self.product.title = "Trail Runner v2"
+        self.product.price = Decimal("25.00")
+        self.product.save()
+
+        response = self.client.get(f"/api/orders/?id={order_id}")
+
+        self.assertEqual(
+            response.data["order_items"],
+            [{
+                "id": Order_Item.objects.get().id,
+                "product_id": self.product.id,
+                "title": "Trail Runner",
+                "unit_price": Decimal("18.00"),
+                "image": self.image.urls["thumbnail"],
+                "quantity": 2,
+            }],
+        )
+
+    def test_history_pages_newest_first_in_two_queries(self):
+        order_ids = [self._order() for _ in range(3)]
+
+        with self.assertNumQueries(2):
+            first = self.client.get("/api/orders/history/?limit=2")
+        with self.assertNumQueries(2):
+            second = self.client.get(first.data["next"])
+
+        self.assertEqual([order["id"] for order in first.data["results"]], order_ids[:0:-1])
+        self.assertEqual([order["id"] for order in second.data["results"]], order_ids[:1])
+        self.assertIsNone(second.data["next"])
+        self.assertEqual(second.data["results"][0]["address"]["city"], "Austin")
+        self.assertEqual(second.data["results"][0]["order_items"][0]["title"], "Trail Runner")
+
+
+class IdempotencyKeyTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.customer = get_user_model().objects.create_user(email="retry@example.com", password="secret123")
+        self.category = Category.objects.create(name="Shoes")
+        self.product = Products.objects.create(
+            title="Retry Shoe", price=Decimal("10.00"), category=self.category, sku="RT-1", stock=5
+        )
+        self.address = AddressBook.objects.create(
+            user=self.customer,
+            fullName="Test Customer",
+            address="123 Market Street",
+            city="Austin",
+            state="TX",
+            zipcode="73301",
+            phone="+15125550100",
+            default_address=True,
+        )
+        self.payload = {
+            "address_id": self.address.id,
+            "payment": "COD",
+            "total": "10.00",
+            "order_items": [{"product_id": self.product.id, "quantity": 1}],
+        }
+        self.client.force_authenticate(user=self.customer)
+
+    def _order(self, key, payload=None):
+        return self.client.post(
+            "/api/orders/", payload or self.payload, format="json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def _in_flight(self, key, locked_until):
+        return IdempotencyKey.objects.create(
+            user=self.customer,
+            key=key,
+            fingerprint=request_fingerprint(SimpleNamespace(method="POST", path="/api/orders/", data=self.payload)),
+            locked_until=locked_until,
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+
+    def test_retries_replay_the_first_order_instead_of_creating_another(self):
+        first = self._order("order-1")
+        with patch("core.views.create_order_from_payload") as create:
+            retry = self._order("order-1")
+
+        create.assert_not_called()
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 4)
+
+        mismatch = self._order("order-1", {**self.payload, "total": "20.00"})
+        self.assertEqual(mismatch.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(self._order("order-2").status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_in_flight_duplicate_conflicts_and_expired_keys_are_purged(self):
+        self._in_flight("order-1", locked_until=timezone.now() + timedelta(minutes=1))
+        response = self._order("order-1")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Order.objects.exists())
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        call_command("purge_idempotency_keys", stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self._order("order-1").status_code, status.HTTP_201_CREATED)
+
+    def test_retry_takes_over_a_key_whose_lease_lapsed(self):
+        # The worker that claimed the key died before finishing.
+        self._in_flight("order-1", locked_until=timezone.now() - timedelta(seconds=1))
+
+        response = self._order("order-1")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 1)
+        record = IdempotencyKey.objects.get(key="order-1")
+        self.assertEqual((record.status, record.response_body["id"]), (IdempotencyKey.COMPLETED, response.data["id"]))
+
+    @override_settings(STRIPE_SECRET_KEY="sk_test")
+    def test_stripe_failure_is_not_replayed(self):
+        payload = {"address_id": self.address.id, "order_items": self.payload["order_items"]}
+        session = SimpleNamespace(id="cs_retry", url="https://checkout.test/cs_retry")
+
+        def checkout(create):
+            with patch("core.views.stripe.checkout.Session.create", create):
+                return self.client.post(
+                    "/api/payments/create-checkout-session/", payload, format="json",
+                    HTTP_IDEMPOTENCY_KEY="checkout-1",
+                )
+
+        failed = checkout(Mock(side_effect=stripe.APIConnectionError("Stripe is down.")))
+        retry = checkout(Mock(return_value=session))
+
+        self.assertEqual(failed.status_code, status.HTTP_502_BAD_GATEWAY)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK, retry.data)
+        self.assertEqual(retry.data["id"], "cs_retry")
+        self.assertNotIn("Idempotent-Replayed", retry)
+
+
 class StripeSession(dict):
     def __init__(self, session_id, payment_status, metadata, payment_intent):
         super().__init__(payment_intent=payment_intent)
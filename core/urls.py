@@ -2,8 +2,12 @@ from django.urls import path
 from .views import *
 urlpatterns = [
     path('products/',view=ProductsView.as_view()),
+    path('products/facets/',view=ProductFacetsView.as_view()),
+    path('products/export/',view=ProductExportView.as_view()),
     path('product/<int:id>',view=SingleProduct.as_view()),
     path('cart/', view=CartItemView.as_view()),
+    path('cart/summary/', view=CartSummaryView.as_view()),
+    path('cart/batch/', view=CartBatchView.as_view()),
     path('login/', view=UserLoginAPIView.as_view()),
     path('addressbook/',AddressBookView.as_view()),
     path('me/',UserView.as_view()),
@@ -11,6 +15,7 @@ urlpatterns = [
     path('register/',UserRegisterView.as_view()),
     path('logout/',view=logout.as_view()),
     path('orders/',view=OrderView.as_view()),
+    path('orders/history/',view=OrderHistoryView.as_view()),
     path('order/',view=OrderItemView.as_view()),
     path('categories/',view=CategoryView.as_view()),
     path('update-password/', UpdatePassword.as_view()),
@@ -26,5 +31,8 @@ urlpatterns = [
 
     ## Admin Panel
     path('upload/products/',view=ProductUploadView.as_view()),
+    path('upload/products/bulk/',view=ProductBulkImportView.as_view()),
     path('upload/image/',view=ImageUploadView.as_view()),
+    path('upload/images/',view=BulkImageUploadView.as_view()),
+    path('upload/images/jobs/<str:job_id>/',view=ImageUploadJobView.as_view()),
 ]
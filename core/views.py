@@ -1,41 +1,50 @@
 import random
 import json
+import uuid
 import stripe
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.filters import SearchFilter,OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated, BasePermission, IsAdminUser
-from .serializers import ProductSerializer,CartItemSerializer,UserLoginSerializer,AddressBookSerializer,UserSerializer,ReviewSerializer,UserRegistrationSerializer,OrderItemSerializer,OrderSerializer,OTPSerializer,CategorySerializer,PasswordUpdateSerializer, WishListSerializer,SearchAutoCompleteSerializer,ImageSerializer,CategoryUploadSerializer,ProductUploadSerializer
+from .serializers import ProductSerializer,CartItemSerializer,UserLoginSerializer,AddressBookSerializer,UserSerializer,ReviewSerializer,UserRegistrationSerializer,OrderItemSerializer,OrderSerializer,OTPSerializer,CategorySerializer,PasswordUpdateSerializer, WishListSerializer,ImageSerializer,CategoryUploadSerializer,ProductUploadSerializer,ImageVariantSerializer
 from rest_framework import generics
 from rest_framework import status
-from .models import Products,Image,CartItem,Cart, AddressBook,Reviews,Order,Order_Item,Category,OTP,User_Verification_Token, WishList
+from .models import Products,Image,CartItem,Cart, AddressBook,Reviews,Order,Order_Item,Category,OTP,User_Verification_Token, WishList, StockReservation
 from rest_framework.authtoken.models import Token
 from rest_framework.authentication import authenticate
 from django.contrib.auth import get_user_model
 from rest_framework.parsers import MultiPartParser,FormParser
-from django.db.models import Case, Value, When
 from django.db import transaction, IntegrityError
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from .helper import genereat_otp,send_otp
+from .helper import MONEY_QUANT,genereat_otp,parse_int,send_otp
+from .search import ProductSearchFilter
+from .autocomplete import product_title_index
+from .pagination import KeysetPagination
+from .category_tree import get_category_tree
+from .facets import get_facets
+from .product_cache import get_product_detail, get_product_version
+from .conditional import conditional_get, make_etag, queryset_etag
+from .idempotency import idempotent
+from .importers import IMPORT_FORMATS, ProductImporter, detect_format
+from .exports import EXPORT_FORMATS, negotiate_encoding, stream_export
+from .reviews import get_review_summary
+from .cart_summary import get_cart_summary
+from .cart_batch import apply_cart_operations
+from .query_plan import planned
+from .pricing import PricingError, price_order_items
+from .stock import InsufficientStock, available_stock, decrement_stock, release_session, rename_reservation, reservation_ttl, reserve_stock, with_shard_flag
+from .image_uploads import async_uploads_available, get_upload_job, start_upload_job, upload_images
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.functional import cached_property
 CustomUser = get_user_model()
 
 
-def parse_int(value):
-    try:
-        return int(value)
-    except (TypeError, ValueError):
-        return None
-
-
-MONEY_QUANT = Decimal("0.01")
-
-
 def parse_decimal(value):
     try:
         if value is None or value == "":
@@ -67,6 +76,15 @@ class OrderCreationError(Exception):
     pass
 
 
+def order_line_images(product_ids):
+    """Each product's first image (thumbnail variant) for order line snapshots, in one query."""
+    images = {}
+    rows = Image.objects.filter(product_id__in=set(product_ids)).order_by("-id").values_list("product_id", "urls")
+    for product_id, urls in rows:
+        images[product_id] = urls.get("thumbnail") or urls.get("full") or ""
+    return images
+
+
 def create_order_from_payload(
     user,
     address_id,
@@ -77,7 +95,13 @@ def create_order_from_payload(
     stripe_checkout_session_id=None,
     stripe_payment_intent_id=None,
     validate_total=True,
+    charged_prices=False,
 ):
+    """
+    With `charged_prices`, `order_items` come from a paid checkout session's
+    metadata and carry the `unit_price` each line was charged; the line
+    snapshots keep those rather than today's prices.
+    """
     if payment not in ["COD", "Online"]:
         raise OrderCreationError("Invalid payment method.")
 
@@ -95,28 +119,16 @@ def create_order_from_payload(
 
     try:
         with transaction.atomic():
-            order_lines = []
-            calculated_total = Decimal("0.00")
-
-            for order_item in normalized_items:
-                product_id = order_item.get("product_id")
-                quantity = order_item.get("quantity")
-                product = Products.objects.select_for_update().filter(id=product_id).first()
-
-                if not product:
-                    raise OrderCreationError("Product Not Found...")
-                if quantity is None or quantity < 1:
-                    raise OrderCreationError("Invalid quantity.")
-                if quantity > product.stock:
-                    raise OrderCreationError(f"Insufficient stock for {product.title}.")
-
-                line_total = (product.price * quantity).quantize(
-                    MONEY_QUANT, rounding=ROUND_HALF_UP
-                )
-                calculated_total = (calculated_total + line_total).quantize(
-                    MONEY_QUANT, rounding=ROUND_HALF_UP
-                )
-                order_lines.append((order_item, product, quantity))
+            # A paid checkout session turns its hold into the sale below;
+            # hand the units back first so pricing counts them as available.
+            if stripe_checkout_session_id:
+                release_session(stripe_checkout_session_id)
+            # One locked fetch prices every line.
+            try:
+                priced = price_order_items(normalized_items, address=address, lock=True)
+            except PricingError as err:
+                raise OrderCreationError(str(err))
+            calculated_total = priced.total
 
             if validate_total and total_amount != calculated_total:
                 raise OrderCreationError("Order total mismatch.")
@@ -131,16 +143,28 @@ def create_order_from_payload(
                 stripe_payment_intent_id=stripe_payment_intent_id,
             )
 
-            for order_item, product, quantity in order_lines:
-                Order_Item.objects.create(
-                    product=product,
+            images = order_line_images(line.product.id for line in priced.lines)
+            if charged_prices:
+                unit_prices = [parse_decimal(item.get("unit_price")) for item in order_items]
+            else:
+                unit_prices = [None] * len(priced.lines)
+            Order_Item.objects.bulk_create([
+                Order_Item(
+                    product=line.product,
                     order=order,
-                    quantity=quantity,
+                    quantity=line.quantity,
+                    unit_price=line.unit_price if unit_price is None else unit_price,
+                    title=line.product.title,
+                    image=images.get(line.product.id, ""),
                 )
-
-                product.stock -= quantity
-                product.sold += quantity
-                product.save(update_fields=["stock", "sold"])
+                for line, unit_price in zip(priced.lines, unit_prices)
+            ])
+            # The rows are already locked; the stock check is repeated in the
+            # UPDATE so repeated lines for one product are covered too.
+            try:
+                decrement_stock((line.product.id, line.quantity) for line in priced.lines)
+            except InsufficientStock as err:
+                raise OrderCreationError(str(err))
 
             # Clear requested items from cart (or fallback by product ids)
             cart = Cart.objects.filter(user=user).first()
@@ -183,34 +207,28 @@ class StandardPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class ProductKeysetPagination(KeysetPagination):
+    page_size = StandardPagination.page_size
+    max_page_size = StandardPagination.max_page_size
+
+
+class ReviewKeysetPagination(KeysetPagination):
+    page_size = StandardPagination.page_size
+    max_page_size = StandardPagination.max_page_size
+    default_ordering = '-created_at'
+
+
 class SearchAutoComplete(APIView):
     def get(self, request):
         query = request.query_params.get('query')
         if not query:
             return Response([])
-        products = Products.objects.filter(title__icontains=query)
-        products = Products.objects.filter(title__icontains=query).annotate(
-            priority=Case(
-                When(title__istartswith=query, then=Value(0)),
-                When(title__icontains=f" {query}", then=Value(1)),
-                When(title__icontains=query, then=Value(2)),
-                default=Value(3)            
-            )).order_by("priority","title")
-        
-        ## Removing duplicates
-        unique_products = {product.title: product for product in products}.values()
-
-        ## Limiting to 10 results
-        unique_products = list(unique_products)[:10]
+        return Response(product_title_index.search(query, limit=10))
 
-        serializer = SearchAutoCompleteSerializer(unique_products, many=True)
-        return Response(serializer.data)
-
-class ProductsView(generics.ListAPIView):
+class ProductFilterMixin:
+    """Catalog filtering shared by every endpoint that mirrors /products/."""
     queryset = Products.objects.all()
-    serializer_class = ProductSerializer
-    pagination_class = StandardPagination
-    filter_backends = [SearchFilter,OrderingFilter]
+    filter_backends = [ProductSearchFilter,OrderingFilter]
     search_fields = ['title','description']
     ordering_fields = ['price','created_at','title','rating','sold']
 
@@ -226,8 +244,10 @@ class ProductsView(generics.ListAPIView):
             # Filter products by title
             queryset = queryset.filter(title__icontains=title)
         if categories:
-            # Filter products by categories
-            queryset = queryset.filter(category__name__in=categories)
+            # Filter products by categories, including their subcategories
+            queryset = queryset.filter(
+                category__in=Category.objects.filter(name__in=categories).with_descendants()
+            )
         if min_price:
             # Filter products by minimum price
             queryset = queryset.filter(price__gte=min_price)
@@ -237,6 +257,78 @@ class ProductsView(generics.ListAPIView):
         
         return queryset
 
+class ProductsView(ProductFilterMixin, generics.ListAPIView):
+    queryset = Products.objects.select_related('snapshot')
+    serializer_class = ProductSerializer
+    pagination_class = StandardPagination
+
+    @property
+    def paginator(self):
+        # Opt-in keyset mode for infinite scroll: ?pagination=cursor or ?cursor=...
+        if not hasattr(self, '_paginator'):
+            if ProductKeysetPagination.requested(self.request):
+                self._paginator = ProductKeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = self.get_serializer().fields
+        if 'imgs' not in fields:
+            # Sparse request without images: plain columns, no snapshot join.
+            columns = {field.source for field in fields.values() if field.source in self.product_columns}
+            queryset = queryset.select_related(None).only(
+                'id', 'category_id', *columns, *self.ordering_fields
+            )
+        return queryset
+
+    @cached_property
+    def product_columns(self):
+        return {field.name for field in Products._meta.concrete_fields}
+
+    def get_validators(self, request, *args, **kwargs):
+        if ProductKeysetPagination.requested(request):
+            # Cursor pages stay constant-time: no aggregate over the whole filter.
+            return None, None
+        queryset = self.filter_queryset(self.get_queryset())
+        etag = queryset_etag(queryset, sorted(request.query_params.lists()), get_category_tree().etag)
+        return etag, None
+
+    @conditional_get
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+class ProductFacetsView(ProductFilterMixin, generics.GenericAPIView):
+    def get(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(get_facets(queryset, request.query_params), status=status.HTTP_200_OK)
+
+class ProductExportView(ProductFilterMixin, generics.GenericAPIView):
+    """
+    Whole-catalog export for partners, streamed row by row instead of paged.
+    Takes the /products/ filters plus ?output=csv|ndjson and honours
+    Accept-Encoding (br when available, else gzip).
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response({'output': [f'Expected one of: {", ".join(EXPORT_FORMATS)}.']}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(self.get_queryset())
+        if not queryset.query.order_by:
+            queryset = queryset.order_by('id')
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+
+        response = StreamingHttpResponse(stream_export(queryset, output, encoding), content_type=EXPORT_FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="products.{output}"'
+        response['Vary'] = 'Accept-Encoding'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        return response
+
 class ProductUploadView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated, IsAdminUser]
@@ -248,6 +340,21 @@ class ProductUploadView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class ProductBulkImportView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        format = request.data.get('format') or detect_format(upload.name)
+        if format not in IMPORT_FORMATS:
+            return Response({'format': [f'Expected one of: {", ".join(IMPORT_FORMATS)}.']}, status=status.HTTP_400_BAD_REQUEST)
+        report = ProductImporter().run(upload, format)
+        return Response(report, status=status.HTTP_200_OK)
+
 class ImageUploadView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated, IsAdminUser]
@@ -260,6 +367,47 @@ class ImageUploadView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class BulkImageUploadView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        product = Products.objects.filter(id=parse_int(request.data.get('product'))).first()
+        if product is None:
+            return Response({'product': ['Product not found.']}, status=status.HTTP_400_BAD_REQUEST)
+        files = request.FILES.getlist('images')
+        if not files:
+            return Response({'images': ['No files were submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        max_files = getattr(settings, 'IMAGE_UPLOAD_MAX_FILES', 20)
+        if len(files) > max_files:
+            return Response({'images': [f'At most {max_files} files per request.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.query_params.get('async') in ('1', 'true'):
+            if not async_uploads_available():
+                return Response(
+                    {'async': ['Background uploads need a shared cache backend (set CACHE_URL).']},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            job_id = start_upload_job(product, files)
+            return Response({'job': job_id, 'status': 'pending'}, status=status.HTTP_202_ACCEPTED)
+
+        images, errors = upload_images(product, files)
+        data = {'images': ImageVariantSerializer(images, many=True).data, 'errors': errors}
+        if not images:
+            return Response(data, status=status.HTTP_502_BAD_GATEWAY)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+class ImageUploadJobView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, job_id):
+        job = get_upload_job(job_id)
+        if job is None:
+            return Response({'message': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job, status=status.HTTP_200_OK)
+
 class HandleOTP(APIView):
     def post(self,request):
         serialzer = OTPSerializer(data=request.data)
@@ -298,10 +446,20 @@ class VerifyOTP(APIView):
         
 
 class SingleProduct(APIView):
+    def get_validators(self, request, id):
+        self.version = version = get_product_version(id)
+        if version is None:
+            return None, None
+        updated_at, columns = version
+        # ?fields=/?exclude=/?expand= change the body, so they are part of the tag.
+        params = sorted(request.query_params.lists())
+        return make_etag(id, updated_at.isoformat(), *columns, params, get_category_tree().etag), updated_at
+
+    @conditional_get
     def get(self,request,id):
-        obj = Products.objects.filter(id=id).first()
-        if obj:
-            return Response(ProductSerializer(obj).data)
+        data = get_product_detail(id, version=self.version)
+        if data:
+            return Response(ProductSerializer.prune(data, request))
         else:
             return Response({})
 
@@ -311,7 +469,7 @@ class WishListView(APIView):
 
     def get(self,request):
         objs = WishList.objects.filter(user=request.user)
-        serializer = WishListSerializer(objs,many=True)
+        serializer = planned(WishListSerializer(many=True,context={'request':request}), objs)
         return Response(serializer.data,status=status.HTTP_200_OK)
 
     def put(self,request):
@@ -350,11 +508,12 @@ class CartItemView(APIView):
     def get(self,request):
         total_quantity = request.query_params.get('total_quantity')
         if total_quantity:
-            cart_items = CartItem.objects.filter(cart__user=request.user)
-            return Response({'total_quantity': len(cart_items)}, status=status.HTTP_200_OK)
+            # Kept for the header badge: the number of lines, not units.
+            summary = get_cart_summary(request.user.id)
+            return Response({'total_quantity': summary['lines']}, status=status.HTTP_200_OK)
         else:
             cart_items = CartItem.objects.filter(cart__user=request.user)
-            serializer = CartItemSerializer(cart_items,many=True)
+            serializer = planned(CartItemSerializer(many=True,context={'request':request}), cart_items)
             return Response(serializer.data,status=status.HTTP_200_OK)
 
     def delete(self,request):
@@ -374,9 +533,9 @@ class CartItemView(APIView):
         cart_item = CartItem.objects.filter(cart__user=request.user,product__id=id)
         if not cart_item:
             return Response({"error":"Product Not Found..."},status=status.HTTP_400_BAD_REQUEST)
-        product = Products.objects.filter(id=id).first()
+        product = with_shard_flag(Products.objects.filter(id=id)).first()
         cart_item = cart_item.first()
-        if quantity > product.stock:
+        if quantity > available_stock([product])[product.id]:
             return Response({"status":400,"error":"Sorry, we don't have enough stock for this item."},status=status.HTTP_400_BAD_REQUEST)
         elif quantity > 10:
             return Response({"status":400,"error":"You've reached the maximum quantity for this item."},status=status.HTTP_400_BAD_REQUEST)
@@ -384,6 +543,7 @@ class CartItemView(APIView):
         cart_item.save()
         return Response({"status":200,"success":"Product quantity updated..."},status=status.HTTP_200_OK)
 
+    @idempotent
     def post(self,request):
         product_id = request.data.get('id')
         quantity = parse_int(request.data.get('q'))
@@ -391,13 +551,13 @@ class CartItemView(APIView):
             return Response({"status":400,"error":"Invalid quantity."},status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            product = Products.objects.get(id=product_id)
+            product = with_shard_flag(Products.objects).get(id=product_id)
         except Products.DoesNotExist:
             return Response({"error":"Product Not Found..."},status=status.HTTP_400_BAD_REQUEST)
         cartItems = CartItem.objects.filter(cart__user = request.user,product=product)
         if cartItems: 
             cartItem = cartItems.first()
-            if cartItem.quantity + quantity > product.stock:
+            if cartItem.quantity + quantity > available_stock([product])[product.id]:
                 return Response({"status":400,"error":"Sorry, we don't have enough stock for this item."},status=status.HTTP_400_BAD_REQUEST)
             elif cartItem.quantity + quantity < 1  or cartItem.quantity + quantity > 10:
                 return Response({"status":400,"error":"You've reached the maximum quantity for this item."},status=status.HTTP_400_BAD_REQUEST)
@@ -413,6 +573,32 @@ class CartItemView(APIView):
 
         return Response({"status":200,"success":"Product has been added to your cart!"},status=status.HTTP_200_OK)
 
+class CartBatchView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @idempotent
+    def post(self, request):
+        operations = request.data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return Response({"error": "operations must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        max_operations = getattr(settings, 'CART_BATCH_MAX_OPERATIONS', 100)
+        if len(operations) > max_operations:
+            return Response({"error": f"At most {max_operations} operations per batch."}, status=status.HTTP_400_BAD_REQUEST)
+        partial = request.data.get('partial') in (True, 'true', '1')
+
+        applied, results = apply_cart_operations(request.user, operations, partial=partial)
+        if not applied:
+            return Response({"applied": False, "results": results}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"applied": True, "results": results}, status=status.HTTP_200_OK)
+
+class CartSummaryView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(get_cart_summary(request.user.id), status=status.HTTP_200_OK)
+
 class UserLoginAPIView(APIView):
     def post(self, request):
         serializer = UserLoginSerializer(data=request.data)
@@ -536,8 +722,17 @@ class ReviewsView(APIView,StandardPagination):
         
         id = request.GET.get('id',None)
         if id:
+            if ReviewKeysetPagination.requested(request):
+                # Cursor mode: newest first off the (product, created_at, id)
+                # index, with the cached summary block alongside.
+                objects = Reviews.objects.filter(product_id=id)
+                paginator = ReviewKeysetPagination()
+                result_page = paginator.paginate_queryset(objects, request)
+                response = paginator.get_paginated_response(ReviewSerializer(result_page, many=True).data)
+                response.data['summary'] = get_review_summary(id)
+                return response
+            objects = Reviews.objects.filter(product_id=id).order_by('-created_at', '-id')
             paginator = StandardPagination()
-            objects = Reviews.objects.filter(product__id=id)
             result_page = paginator.paginate_queryset(objects,request)
             serializer = ReviewSerializer(result_page, many=True)
             return paginator.get_paginated_response(serializer.data)
@@ -569,16 +764,18 @@ class OrderView(APIView):
     def get(self,request):
         id = request.GET.get('id')
         if id:
-            objs = Order.objects.filter(user=request.user,id=id)
-            if objs:
-                serializer = OrderSerializer(objs.first())
+            order = Order.objects.filter(user=request.user,id=id).select_related('address').prefetch_related('order_items').first()
+            if order:
+                serializer = OrderSerializer(order)
                 return Response(serializer.data,status=status.HTTP_200_OK)
             else:
                 return Response({"msg":"Not Order Found!"},status=status.HTTP_404_NOT_FOUND)
         else:
             objs = Order.objects.filter(user=request.user)
-            serializer = OrderSerializer(objs,many=True)
+            serializer = planned(OrderSerializer(many=True), objs)
             return Response(serializer.data,status=status.HTTP_200_OK)
+
+    @idempotent
     def post(self,request):
         address_id = request.data.get("address_id")
         payment = request.data.get("payment", "COD")
@@ -603,13 +800,36 @@ class OrderView(APIView):
 
         return Response(OrderSerializer(order).data,status=status.HTTP_201_CREATED)
 
+class OrderHistoryPagination(KeysetPagination):
+    page_size = StandardPagination.page_size
+    max_page_size = StandardPagination.max_page_size
+
+
+class OrderHistoryView(generics.ListAPIView):
+    """
+    The user's orders, newest first, a keyset page at a time. Each page is
+    two queries (orders joined to their address, then all their lines) and
+    lines come from their purchase-time snapshot columns.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderSerializer
+    pagination_class = OrderHistoryPagination
+
+    def get_queryset(self):
+        return (
+            Order.objects.filter(user=self.request.user)
+            .select_related('address')
+            .prefetch_related('order_items')
+        )
+
 class OrderItemView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
     def get(self,request):
         order_id = request.GET.get('order_id')
         objs = Order_Item.objects.filter(order__user=request.user,order=order_id)
-        serializer = OrderItemSerializer(objs,many=True)
+        serializer = planned(OrderItemSerializer(many=True,context={'request':request}), objs)
         return Response(serializer.data,status=status.HTTP_200_OK)
     def post(self,request):
         serializer = OrderItemSerializer(data=request.data)
@@ -627,8 +847,12 @@ class CategoryView(APIView):
             return []
         return [IsAuthenticated(), IsAdminUser()]
 
+    def get_validators(self, request):
+        return get_category_tree().etag, None
+
+    @conditional_get
     def get(self,request):
-        objs = Category.objects.all()
+        objs = get_category_tree().nodes()
         serializer = CategorySerializer(objs,many=True)
         return Response(serializer.data,status=status.HTTP_200_OK)
     
@@ -641,10 +865,30 @@ class CategoryView(APIView):
             return Response(serializer.errors,status=status.HTTP_400_BAD_REQUEST)
 
 
+def release_abandoned_checkouts(user):
+    """
+    Expire `user`'s earlier open checkout sessions and hand back their holds,
+    so a customer coming back from Stripe isn't blocked by their own hold.
+    A session Stripe won't expire (already paid or expired, or Stripe is
+    unreachable) keeps its hold for the webhook or the sweeper.
+    """
+    sessions = (
+        StockReservation.objects.filter(user=user).exclude(session_id__startswith="pending:")
+        .values_list("session_id", flat=True).distinct()
+    )
+    for session_id in list(sessions):
+        try:
+            stripe.checkout.Session.expire(session_id)
+        except Exception:
+            continue
+        release_session(session_id)
+
+
 class StripeCheckoutSessionView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         if not settings.STRIPE_SECRET_KEY:
             return Response(
@@ -656,57 +900,68 @@ class StripeCheckoutSessionView(APIView):
         order_items = normalize_order_items(request.data.get("order_items", []))
         if not order_items:
             return Response({"error": "No order items provided."}, status=status.HTTP_400_BAD_REQUEST)
-        if not AddressBook.objects.filter(id=address_id, user=request.user).exists():
+        address = AddressBook.objects.filter(id=address_id, user=request.user).first()
+        if not address:
             return Response({"error": "Invalid address."}, status=status.HTTP_400_BAD_REQUEST)
 
         stripe.api_key = settings.STRIPE_SECRET_KEY
-        line_items = []
-        calculated_total = Decimal("0.00")
-
-        for item in order_items:
-            product = Products.objects.filter(id=item.get("product_id")).first()
-            quantity = item.get("quantity")
-            if not product:
-                return Response({"error": "Product Not Found..."}, status=status.HTTP_400_BAD_REQUEST)
-            if quantity is None or quantity < 1:
-                return Response({"error": "Invalid quantity."}, status=status.HTTP_400_BAD_REQUEST)
-            if quantity > product.stock:
-                return Response(
-                    {"error": f"Insufficient stock for {product.title}."},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
+        release_abandoned_checkouts(request.user)
+        try:
+            priced = price_order_items(order_items, address=address)
+        except PricingError as err:
+            return Response({"error": str(err)}, status=status.HTTP_400_BAD_REQUEST)
+        calculated_total = priced.total
 
-            unit_amount = money_to_cents(product.price)
+        line_items = []
+        for line in priced.lines:
+            unit_amount = money_to_cents(line.unit_price)
             if unit_amount <= 0:
                 return Response(
-                    {"error": f"Invalid price for {product.title}."},
+                    {"error": f"Invalid price for {line.product.title}."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            line_total = (product.price * quantity).quantize(
-                MONEY_QUANT, rounding=ROUND_HALF_UP
-            )
-            calculated_total = (calculated_total + line_total).quantize(
-                MONEY_QUANT, rounding=ROUND_HALF_UP
-            )
             line_items.append(
                 {
                     "price_data": {
                         "currency": "usd",
                         "unit_amount": unit_amount,
                         "product_data": {
-                            "name": product.title,
+                            "name": line.product.title,
                         },
                     },
-                    "quantity": quantity,
+                    "quantity": line.quantity,
                 }
             )
+        for name, amount in (("Tax", priced.tax), ("Shipping", priced.shipping)):
+            if amount > 0:
+                line_items.append(
+                    {
+                        "price_data": {
+                            "currency": "usd",
+                            "unit_amount": money_to_cents(amount),
+                            "product_data": {"name": name},
+                        },
+                        "quantity": 1,
+                    }
+                )
+
+        # Hold the stock before sending the customer to pay; the hold is keyed
+        # by the session id once Stripe has issued one.
+        hold_id = f"pending:{uuid.uuid4().hex}"
+        try:
+            reserve_stock(hold_id, ((line.product.id, line.quantity) for line in priced.lines), user=request.user)
+        except InsufficientStock as err:
+            return Response({"error": str(err)}, status=status.HTTP_400_BAD_REQUEST)
 
         frontend_url = request.headers.get("Origin") or settings.FRONTEND_URL
         metadata = {
             "user_id": str(request.user.id),
             "address_id": str(address_id),
             "total": str(calculated_total),
-            "order_items": json.dumps(order_items),
+            # Each line carries the unit price charged, for the order's snapshot.
+            "order_items": json.dumps([
+                {**item, "unit_price": str(line.unit_price)} for item, line in zip(order_items, priced.lines)
+            ]),
         }
 
         try:
@@ -718,9 +973,13 @@ class StripeCheckoutSessionView(APIView):
                 success_url=f"{frontend_url}/order-confirm?session_id={{CHECKOUT_SESSION_ID}}",
                 cancel_url=f"{frontend_url}/cart?payment_cancelled=1",
                 metadata=metadata,
+                expires_at=int((timezone.now() + reservation_ttl()).timestamp()),
             )
         except Exception as err:
-            return Response({"error": str(err)}, status=status.HTTP_400_BAD_REQUEST)
+            release_session(hold_id)
+            # A 5xx, so @idempotent doesn't store it and a retry reaches Stripe again.
+            return Response({"error": str(err)}, status=status.HTTP_502_BAD_GATEWAY)
+        rename_reservation(hold_id, checkout_session.id)
 
         return Response(
             {
@@ -803,6 +1062,7 @@ class StripeSessionStatusView(APIView):
                 stripe_checkout_session_id=checkout_session.id,
                 stripe_payment_intent_id=payment_intent_id,
                 validate_total=False,
+                charged_prices=True,
             )
         except OrderCreationError as err:
             return Response({"error": str(err)}, status=status.HTTP_400_BAD_REQUEST)
@@ -866,10 +1126,14 @@ class StripeWebhookView(APIView):
                     stripe_checkout_session_id=session.get("id"),
                     stripe_payment_intent_id=session.get("payment_intent"),
                     validate_total=False,
+                    charged_prices=True,
                 )
             except OrderCreationError:
                 return Response(status=status.HTTP_200_OK)
 
+        elif event.get("type") == "checkout.session.expired":
+            release_session(event["data"]["object"].get("id"))
+
         return Response(status=status.HTTP_200_OK)
 
 class logout(APIView):
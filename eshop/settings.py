@@ -134,6 +134,19 @@ DATABASES = {
 # }
  
 
+# Point CACHE_URL at a cache every worker shares in production: cart
+# summaries are only cached there, and async image uploads need it.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+PRODUCT_DETAIL_CACHE_ALIAS = 'default'
+PRODUCT_DETAIL_CACHE_TIMEOUT = env.int('PRODUCT_DETAIL_CACHE_TIMEOUT', default=60 * 60)
+
+# Each worker keeps its own autocomplete index of product titles; it is
+# rebuilt after this many seconds to pick up writes made by other workers.
+AUTOCOMPLETE_INDEX_TTL = env.int('AUTOCOMPLETE_INDEX_TTL', default=5 * 60)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -179,6 +192,46 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cloudinary delivery transformations precomputed for every product image.
+IMAGE_VARIANTS = {
+    'thumbnail': {'width': 200, 'height': 200, 'crop': 'fill', 'quality': 'auto', 'fetch_format': 'auto', 'secure': True},
+    'medium': {'width': 600, 'crop': 'limit', 'quality': 'auto', 'fetch_format': 'auto', 'secure': True},
+    'full': {'quality': 'auto', 'fetch_format': 'auto', 'secure': True},
+}
+
+# Pricing hooks: dotted paths to callables (priced_cart, address) -> Decimal.
+PRICING_TAX_CALCULATOR = 'core.pricing.no_tax'
+PRICING_SHIPPING_CALCULATOR = 'core.pricing.free_shipping'
+
+# Stripe checkout sessions expire after STOCK_RESERVATION_TTL seconds (Stripe
+# accepts 30 minutes to 24 hours); their stock holds last a little longer and
+# are swept by `manage.py release_expired_reservations`.
+STOCK_RESERVATION_TTL = env.int('STOCK_RESERVATION_TTL', default=60 * 60)
+
+# Seconds a sharded product's summed shard stock is cached between writes.
+STOCK_SHARD_TOTAL_CACHE_TIMEOUT = 60
+
+# Idempotency-Key handling for order, cart and checkout POSTs: how long a
+# stored response is replayed (expired keys are removed by
+# `manage.py purge_idempotency_keys`), how many seconds a duplicate waits
+# for an in-flight original before getting a 409, and how long an
+# in-flight request holds its key before a retry may take it over (keep it
+# above the worker timeout).
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_LEASE = 120
+
+# Bulk image uploads (upload/images/): per-request upload threads, background
+# job threads for ?async=1, and the client used to talk to Cloudinary.
+# ?async=1 is refused unless CACHE_URL points at a cache shared by every
+# worker (redis, memcached, database, file), since job state lives there.
+# Jobs run in the worker that accepted them, so a restart drops any still
+# queued; clients should re-submit jobs that stay pending.
+IMAGE_UPLOAD_WORKERS = env.int('IMAGE_UPLOAD_WORKERS', default=4)
+IMAGE_UPLOAD_JOB_WORKERS = env.int('IMAGE_UPLOAD_JOB_WORKERS', default=2)
+IMAGE_UPLOAD_MAX_FILES = 20
+IMAGE_UPLOAD_CLIENT = 'core.image_uploads.CloudinaryUploadClient'
+
 cloudinary.config(
     cloud_name = env("CLOUDINARY_CLOUD_NAME", default=""),
     api_key = env("CLOUDINARY_API_KEY", default=""),